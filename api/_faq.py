@@ -0,0 +1,247 @@
+"""Local answers for common free-text paint questions in /chat.
+
+Each entry restates one fact from the product and surface-prep knowledge
+in _knowledge.json, with the ways shoppers ask for it in English and Afrikaans.
+A BM25 index over those phrasings is built at import. A question is
+answered locally only when one entry clearly wins and covers every word
+of the question that the index knows, and the question names no surface,
+sealer or product; everything else goes to the model, which has the
+matching guide.
+
+Answers quote prices and specs through {fact} placeholders, filled from
+the same facts the system prompt uses.
+"""
+import math
+import re
+
+from _knowledge import FACTS, KNOWLEDGE, PRODUCTS, SURFACES
+
+FAQ_ENTRIES = [
+    {
+        'id': 'drying',
+        'questions': [
+            "How long does it take to dry?", "What is the drying time?", "When can I do a second coat?",
+            "How long between coats?", "How long to cure?", "When is it fully dry?",
+            "Hoe lank neem dit om droog te word?", "Wat is die droogtyd?", "Wanneer kan ek die tweede laag verf?",
+            "Hoe lank tussen lae?", "Wanneer is dit heeltemal droog?",
+        ],
+        'answer': {
+            'en': "Chalk paint is touch-dry in about {touch_dry_minutes} minutes and ready for the next coat after {recoat_hours} hours. It only reaches full cure after {full_cure_days} days, so go gently on the piece for the first few weeks.",
+            'af': "Ons krytverf is binne sowat {touch_dry_minutes} minute aanraakdroog en na {recoat_hours} uur gereed vir die volgende laag. Dit is eers na {full_cure_days} dae volledig uitgehard, so wees die eerste paar weke saggies met die stuk.",
+        },
+    },
+    {
+        'id': 'coverage',
+        'questions': [
+            "How much does a litre cover?", "What is the coverage per litre?", "How many square metres does 1L cover?",
+            "How much paint do I need?", "Coverage of one tin?",
+            "Hoeveel dek een liter?", "Wat is die dekking per liter?", "Hoeveel vierkante meter dek 1L?",
+            "Hoeveel verf het ek nodig?",
+        ],
+        'answer': {
+            'en': "1L covers roughly {coverage_m2} square metres per coat. For a small piece or to test a colour first, the {sample_size} jar (from {sample_price}) goes a surprisingly long way.",
+            'af': "1L dek ongeveer {coverage_m2} vierkante meter per laag. Vir 'n klein stuk, of om eers 'n kleur te toets, strek die {sample_size}-potjie (vanaf {sample_price}) verbasend ver.",
+        },
+    },
+    {
+        'id': 'surfaces',
+        'questions': [
+            "What surfaces does it work on?", "Can I paint metal?", "Can I paint fabric?", "Does it work on enamel?",
+            "Op watter oppervlaktes werk dit?", "Kan ek metaal verf?", "Kan ek materiaal verf?",
+        ],
+        'answer': {
+            'en': "Yes! Chalk paint works on glass, metal, wood, ceramic, enamel, melamine and even fabric, usually with no sanding or priming. Tell me what you're painting and I'll give you the right prep steps.",
+            'af': "Ja! Ons krytverf werk op glas, metaal, hout, keramiek, emalje, melamien en selfs materiaal, gewoonlik sonder skuur of grondverf. Vertel my wat jy verf, dan gee ek jou die regte voorbereiding.",
+        },
+    },
+    {
+        'id': 'no-prep',
+        'questions': [
+            "Do I need to sand first?", "Do I need a primer?", "Do I need to prime before painting?",
+            "Is there any prep needed?", "Do I have to sand it?",
+            "Moet ek eers skuur?", "Het ek grondverf nodig?", "Is daar voorbereiding nodig?", "Moet ek dit skuur?",
+        ],
+        'answer': {
+            'en': "In most cases there's no sanding or priming needed, which is the magic of chalk paint. Just give the surface a good scrub with sugar soap and let it dry. Very glossy surfaces like melamine or tiles do better with a light sand to de-gloss.",
+            'af': "In die meeste gevalle hoef jy nie te skuur of grondverf te gebruik nie, dis die towerkrag van krytverf. Skrop net die oppervlak goed met suikerseep en laat dit droog word. Baie blink oppervlaktes soos melamien of teëls hou van 'n ligte skuur om die glans af te haal.",
+        },
+    },
+    {
+        'id': 'safety',
+        'questions': [
+            "Is it safe for kids?", "Is it food safe?", "Is it lead free?", "Does it smell?", "Is it eco-friendly?",
+            "Is it non-toxic?", "Can I use it on a baby cot or toys?",
+            "Is dit veilig vir kinders?", "Is dit voedselveilig?", "Is dit loodvry?", "Ruik dit sterk?",
+            "Is dit omgewingsvriendelik?",
+        ],
+        'answer': {
+            'en': "Yes, the chalk paint is lead-free, low-odour, eco-friendly, food-safe and kid-safe. For kids' furniture and toys, seal it with a water-based sealer like Armour rather than an oil-based wax.",
+            'af': "Ja, ons krytverf is loodvry, reukarm, omgewingsvriendelik, voedselveilig en kindveilig. Vir kindermeubels en speelgoed, seël dit met 'n waterbasis-seëlaar soos Armour eerder as 'n olie-gebaseerde was.",
+        },
+    },
+    {
+        'id': 'sizes',
+        'questions': [
+            "What sizes does it come in?", "How much does it cost?", "What is the price?", "Is there a sample size?",
+            "How much is a litre?",
+            "Watter groottes is daar?", "Hoeveel kos dit?", "Wat is die prys?", "Is daar 'n toetsgrootte?",
+        ],
+        'answer': {
+            'en': "It comes in {sample_size} jars from {sample_price} (perfect for testing a colour or small makeovers), 500ml, and 1L from {litre_price}, all on the same shelf.",
+            'af': "Dit kom in {sample_size}-potjies vanaf {sample_price} (perfek om 'n kleur te toets of vir klein projekte), 500ml, en 1L vanaf {litre_price}, alles op dieselfde rak.",
+        },
+    },
+    {
+        'id': 'online',
+        'questions': [
+            "Can I buy online?", "Do you deliver?", "Is there free delivery?", "Where can I order?",
+            "Kan ek aanlyn koop?", "Lewer julle af?", "Is daar gratis aflewering?", "Waar kan ek bestel?",
+        ],
+        'answer': {
+            'en': "You can grab it right here at Leroy Merlin, or order online at {shop_url} with free delivery on orders over {free_delivery_over}.",
+            'af': "Jy kan dit sommer hier by Leroy Merlin kry, of aanlyn bestel by {shop_url} met gratis aflewering op bestellings bo {free_delivery_over}.",
+        },
+    },
+    {
+        'id': 'payment',
+        'questions': [
+            "Can I pay in instalments?", "Do you have PayJustNow?", "Do you take HappyPay?", "What payment options are there?",
+            "Kan ek paaiemente betaal?", "Het julle PayJustNow?", "Watter betaalopsies is daar?",
+        ],
+        'answer': {
+            'en': "Online at {shop_url} you can pay with PayJustNow ({payjustnow_instalments} instalments) or HappyPay ({happypay_paydays} paydays).",
+            'af': "Aanlyn by {shop_url} kan jy met PayJustNow ({payjustnow_instalments} paaiemente) of HappyPay ({happypay_paydays} betaaldae) betaal.",
+        },
+    },
+    {
+        'id': 'rewards',
+        'questions': [
+            "Is there a rewards programme?", "Do you have loyalty points?", "How do rewards work?",
+            "Is daar 'n belonings program?", "Het julle lojaliteitspunte?",
+        ],
+        'answer': {
+            'en': "Yes! There's a rewards programme, and you can sign up at {rewards_url}.",
+            'af': "Ja! Daar is 'n belonings program, en jy kan inskryf by {rewards_url}.",
+        },
+    },
+    {
+        'id': 'colours',
+        'questions': [
+            "How many colours are there?", "What colours do you have?", "Is there a colour chart?",
+            "Hoeveel kleure is daar?", "Watter kleure het julle?",
+        ],
+        'answer': {
+            'en': "There are {colour_count} chalk paint colours, all on the same shelf. If you can't decide, grab a {sample_size} sample jar ({sample_price}) and try it on your piece first.",
+            'af': "Daar is {colour_count} krytverfkleure, almal op dieselfde rak. As jy nie kan besluit nie, kry 'n {sample_size}-toetspotjie ({sample_price}) en probeer dit eers op jou stuk.",
+        },
+    },
+    {
+        'id': 'spraying',
+        'questions': [
+            "Can I spray it?", "Can I use a spray gun?", "How much should I dilute it?", "Can I thin it with water?",
+            "Kan ek dit spuit?", "Hoeveel moet ek dit verdun?", "Kan ek dit met water verdun?",
+        ],
+        'answer': {
+            'en': "Yes, you can spray it. Dilute by no more than {max_dilution} with distilled water and allow a bit of extra drying time between coats.",
+            'af': "Ja, jy kan dit spuit. Verdun met hoogstens {max_dilution} gedistilleerde water en gee elke laag 'n bietjie ekstra droogtyd.",
+        },
+    },
+]
+
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'it', 'its', 'i', 'my', 'me', 'to', 'of', 'for', 'do', 'does', 'can', 'how', 'what',
+    'on', 'in', 'and', 'or', 'with', 'be', 'this', 'that', 'you', 'your', 'are', 'there', 'will', 'should', 'have',
+    'any', 'which', 'when', 'where', 'why', 'please', 'hi', 'hello', 'thanks', 'so', 'if', 'at', 'by', 'we', 'our',
+    'die', 'n', 'dit', 'ek', 'van', 'vir', 'hoe', 'wat', 'op', 'en', 'of', 'met', 'kan', 'sal', 'moet', 'jy',
+    'julle', 'om', 'te', 'het', 'daar', 'is', 'nie', 'ons', 'my', 'asseblief', 'watter', 'wanneer', 'waar', 'hoekom',
+    # Nearly every question is about painting, so these carry no signal
+    'paint', 'painting', 'verf',
+}
+
+K1 = 1.5
+B = 0.75
+MAX_QUESTION_WORDS = 15
+MIN_SCORE = 1.5
+MIN_COVERAGE = 0.66
+MIN_MARGIN = 1.5
+
+def stem(word):
+    for suffix in ('ing', 's'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith('ss'):
+            return word[:-len(suffix)]
+    return word
+
+def tokenize(text):
+    words = re.findall(r"[a-z0-9à-ÿ]+", re.sub(r"'(s|n)\b", '', text.lower().replace('’', "'")))
+    return [stem(word) for word in words if word not in STOPWORDS]
+
+def build_index(entries):
+    docs = [tokenize(' '.join(entry['questions'])) for entry in entries]
+    df = {}
+    for doc in docs:
+        for term in set(doc):
+            df[term] = df.get(term, 0) + 1
+    n = len(docs)
+    idf = {term: math.log(1 + (n - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+    tfs = []
+    for doc in docs:
+        tf = {}
+        for term in doc:
+            tf[term] = tf.get(term, 0) + 1
+        tfs.append(tf)
+    avg_len = sum(len(doc) for doc in docs) / n
+    return {'tfs': tfs, 'lengths': [len(doc) for doc in docs], 'idf': idf, 'avg_len': avg_len}
+
+INDEX = build_index(FAQ_ENTRIES)
+
+# Words that name the paint range itself rather than one product
+RANGE_WORDS = {'chalk', 'chalkpaint', 'granny', 'b', 'g'}
+
+def build_vocabulary(knowledge):
+    """Surface, sealer and product words from _knowledge.json.
+
+    Each of those has its own instructions there (Armour cures in 72 hours,
+    tiles dry overnight), so a question naming one is left to the model.
+    """
+    names = [keyword for surface in SURFACES for keyword in surface['keywords']]
+    names += [line.split(':')[0] for line in knowledge['sealers'] if not line.startswith('NB:')]
+    names += [product['name'] for product in PRODUCTS.values()]
+    return {term for name in names for term in tokenize(name)
+            if term not in RANGE_WORDS and not any(c.isdigit() for c in term)}
+
+VOCABULARY = build_vocabulary(KNOWLEDGE)
+
+def score(terms, i):
+    tf, length = INDEX['tfs'][i], INDEX['lengths'][i]
+    total = 0.0
+    for term in terms:
+        if term in tf:
+            freq = tf[term]
+            total += INDEX['idf'][term] * freq * (K1 + 1) / (freq + K1 * (1 - B + B * length / INDEX['avg_len']))
+    return total
+
+def match(question):
+    """(entry, score) for a confident match, otherwise None."""
+    if len(question.split()) > MAX_QUESTION_WORDS:
+        return None
+    terms = list(dict.fromkeys(tokenize(question)))
+    if not terms or any(term in VOCABULARY for term in terms):
+        return None
+    ranked = sorted(((score(terms, i), i) for i in range(len(FAQ_ENTRIES))), reverse=True)
+    (best, i), (runner_up, _) = ranked[0], ranked[1]
+    # A word the index knows but this entry lacks is about another fact
+    # ("delivery" in "how long does delivery take")
+    if any(term in INDEX['idf'] and term not in INDEX['tfs'][i] for term in terms):
+        return None
+    covered = sum(1 for term in terms if term in INDEX['tfs'][i])
+    if best < MIN_SCORE or covered / len(terms) < MIN_COVERAGE or best < runner_up * MIN_MARGIN:
+        return None
+    return FAQ_ENTRIES[i], best
+
+def answer(question, language):
+    """Templated answer for a common question, or None to ask the model."""
+    found = match(question)
+    if not found:
+        return None
+    templates = found[0]['answer']
+    return templates.get(language, templates['en']).format_map(FACTS)
@@ -0,0 +1,206 @@
+"""Shared HTTPS client for the upstream APIs the handlers call.
+
+Connections are kept alive in a small pool per host, so warm function
+instances skip DNS and the TLS handshake on later calls. Every request gets
+a connect timeout and a read timeout taken from the host's entry in
+TIMEOUTS, or from the caller for hosts that are only known at runtime. 429 and 5xx answers are retried with jittered exponential
+backoff, honouring Retry-After. Each call logs one 'upstream' line with its
+latency, and running totals per host are kept in METRICS.
+
+Failed requests raise urllib.error.HTTPError like urlopen does, so callers
+keep their existing error handling.
+"""
+import http.client
+import io
+import random
+import select
+import threading
+import time
+import urllib.error
+from urllib.parse import urlparse
+
+# host -> (connect timeout, read timeout) in seconds. The read timeout is
+# the longest gap allowed between bytes, not a cap on the whole response.
+TIMEOUTS = {
+    'api.anthropic.com': (5, 60),
+    'api.openai.com': (5, 30),
+    'api.elevenlabs.io': (5, 30),
+    'texttospeech.googleapis.com': (5, 15),
+    'api.brevo.com': (5, 15),
+}
+DEFAULT_TIMEOUT = (5, 30)
+
+POOL_SIZE = 4
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.5
+MAX_RETRY_AFTER = 5.0
+# 529 is Anthropic's "overloaded"
+RETRY_STATUSES = {429, 500, 502, 503, 504, 529}
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+METRICS = {}
+_metrics_lock = threading.Lock()
+
+def connection(scheme, host):
+    with _pool_lock:
+        pool = _pools.get((scheme, host)) or []
+        while pool:
+            conn = pool.pop()
+            if idle(conn):
+                return conn, True
+            conn.close()
+    conn_cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+    return conn_cls(host), False
+
+def idle(conn):
+    """Whether a pooled connection is still open and quiet.
+
+    An idle keep-alive socket has nothing to read; if it is readable the
+    server has closed it (or sent something unexpected), so it is dropped
+    before a request is written to it.
+    """
+    if conn.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+def release(scheme, host, conn):
+    with _pool_lock:
+        pool = _pools.setdefault((scheme, host), [])
+        if len(pool) < POOL_SIZE:
+            pool.append(conn)
+            return
+    conn.close()
+
+def record(host, status, elapsed_ms, attempts):
+    with _metrics_lock:
+        stats = METRICS.setdefault(host, {'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['calls'] += 1
+        stats['retries'] += attempts - 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if not status or status >= 400:
+            stats['errors'] += 1
+    print(f"upstream {host} status={status or 'error'} ms={elapsed_ms:.0f} attempts={attempts}")
+
+def backoff(attempt, retry_after=None):
+    delay = random.uniform(0, BACKOFF_BASE * 2 ** attempt)
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), MAX_RETRY_AFTER))
+        except ValueError:
+            pass  # an HTTP date; the jittered delay will do
+    time.sleep(delay)
+
+class Response:
+    """A response whose connection goes back to the pool once it is read.
+
+    The body is read up front unless stream=True, in which case it is left
+    on the socket: iterate over the response for lines, or read() it,
+    inside a with block.
+    """
+
+    def __init__(self, resp, release_conn, stream):
+        self.status = resp.status
+        self.headers = resp.headers
+        self._resp = resp
+        self._release = release_conn
+        self._body = None
+        if not stream:
+            self._body = self._resp.read()
+            self.close()
+
+    def read(self):
+        if self._body is not None:
+            return self._body
+        try:
+            return self._resp.read()
+        finally:
+            self.close()
+
+    def __iter__(self):
+        if self._body is not None:
+            yield from io.BytesIO(self._body)
+            return
+        try:
+            yield from self._resp
+        finally:
+            self.close()
+
+    def close(self):
+        if self._release:
+            release_conn, self._release = self._release, None
+            # Only a fully read response leaves the connection reusable
+            release_conn(self._resp.isclosed())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def request(method, url, body=None, headers=None, stream=False, retries=MAX_RETRIES, timeout=None):
+    parsed = urlparse(url)
+    scheme, host = parsed.scheme, parsed.netloc
+    path = parsed.path + ('?' + parsed.query if parsed.query else '')
+    connect_timeout, read_timeout = timeout or TIMEOUTS.get(parsed.hostname, DEFAULT_TIMEOUT)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        conn, reused = connection(scheme, host)
+        sent = False
+        try:
+            if not conn.sock:
+                conn.timeout = connect_timeout
+                conn.connect()
+            conn.sock.settimeout(read_timeout)
+            conn.request(method, path, body, headers or {})
+            sent = True
+            resp = conn.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            if reused and not sent and not isinstance(e, TimeoutError):
+                attempt -= 1
+                continue  # the server closed an idle pooled connection; retry on a fresh one
+            # Failing to connect is safe to retry; a request that may have
+            # reached the upstream is not
+            if not sent and attempt <= retries:
+                backoff(attempt - 1)
+                continue
+            record(parsed.hostname, None, (time.monotonic() - started) * 1000, attempt)
+            raise
+
+        if resp.status in RETRY_STATUSES and attempt <= retries:
+            resp.read()
+            finish(scheme, host, conn, resp)
+            backoff(attempt - 1, resp.headers.get('Retry-After'))
+            continue
+
+        record(parsed.hostname, resp.status, (time.monotonic() - started) * 1000, attempt)
+        if resp.status >= 400:
+            data = resp.read()
+            finish(scheme, host, conn, resp)
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+
+        def release_conn(clean, conn=conn, will_close=resp.will_close):
+            if clean and not will_close:
+                release(scheme, host, conn)
+            else:
+                conn.close()
+
+        return Response(resp, release_conn, stream)
+
+def finish(scheme, host, conn, resp):
+    if resp.will_close:
+        conn.close()
+    else:
+        release(scheme, host, conn)
+
+def post(url, body, headers, stream=False, retries=MAX_RETRIES, timeout=None):
+    return request('POST', url, body, headers, stream=stream, retries=retries, timeout=timeout)
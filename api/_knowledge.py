@@ -0,0 +1,76 @@
+"""Product catalogue and surface guides for the /chat system prompt.
+
+The data lives in _knowledge.json and is loaded once per process. Prices
+and specs are written once under "facts" and referenced elsewhere as
+{placeholders}, so the prompt and the FAQ answers quote the same figures.
+The range, colours, sealers and in-store products go into the cached
+static prompt; the scanned product and the surface guides a conversation
+needs are picked per request.
+"""
+import json
+import os
+import re
+
+KNOWLEDGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_knowledge.json')
+
+with open(KNOWLEDGE_PATH, encoding='utf-8') as f:
+    KNOWLEDGE = json.load(f)
+
+FACTS = KNOWLEDGE['facts']
+
+def fill(value):
+    """Value with {fact} placeholders filled in every string it contains."""
+    if isinstance(value, str):
+        return value.format_map(FACTS)
+    if isinstance(value, list):
+        return [fill(item) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item) for key, item in value.items()}
+    return value
+
+KNOWLEDGE = fill(KNOWLEDGE)
+
+PRODUCTS = KNOWLEDGE['products']
+SURFACES = KNOWLEDGE['surfaces']
+
+# Keywords match at the start of a word, so 'varnish' also finds 'varnished'
+SURFACE_PATTERNS = [
+    (surface, re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in surface['keywords']) + ')', re.IGNORECASE))
+    for surface in SURFACES
+]
+
+def bullets(lines):
+    return '\n'.join(f'- {line}' for line in lines)
+
+def range_text():
+    return bullets(KNOWLEDGE['range'])
+
+def colour_text():
+    return bullets(f"{c['name']} ({c['shade']}): {c['suits']}" for c in KNOWLEDGE['colours'])
+
+def sealer_text():
+    return bullets(KNOWLEDGE['sealers'])
+
+def store_product_text(group):
+    return bullets(KNOWLEDGE['store_products'][group])
+
+def product_text(sku):
+    product = PRODUCTS.get(str(sku))
+    if not product:
+        return (f"- The customer scanned SKU {sku}, which is not in this catalogue. Ask which colour and size "
+                "they are holding rather than guessing, and advise from the range above.")
+    lines = [f"The customer scanned: {product['name']} (SKU {sku}, {product['price']})"] + product.get('notes', [])
+    return bullets(lines)
+
+def relevant_surfaces(texts):
+    """Surface guides mentioned anywhere in texts, in guide order."""
+    text = '\n'.join(texts)
+    return [surface for surface, pattern in SURFACE_PATTERNS if pattern.search(text)]
+
+def surface_text(surface):
+    return (f"{surface['title']}:\n"
+            f"Preparation: {surface['preparation']}\n"
+            f"Paint: {surface['paint']}\n"
+            f"Seal: {surface['seal']}")
+
+SURFACE_TITLES = '; '.join(surface['title'].lower() for surface in SURFACES)
@@ -0,0 +1,97 @@
+"""Shared replies for guided-question turns in /chat.
+
+Guided turns are the fixed option buttons in index.html, so shoppers who
+tap the same options for the same product and store get the same advice.
+A conversation is cacheable only while every user turn so far is one of
+those options; the first free-text message opts it out. Replies live on
+the analytics storage backend for CHAT_CACHE_TTL seconds with a small
+in-process LRU in front of it.
+
+Only histories /chat loaded from its own session store are keyed here;
+the assistant turns in them are replies it produced itself.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+import analytics
+
+REPLY_CACHE_TTL = int(os.environ.get('CHAT_CACHE_TTL', str(7 * 24 * 3600)))
+LOCAL_CACHE_SIZE = 256
+
+# Keep in step with guidedQuestionsData / consultGuidedData in index.html
+GUIDED_OPTIONS = {
+    'product': [
+        "Furniture", "Kitchen cabinets", "Home décor / crafts", "Walls / feature wall", "Upcycle / thrift flip", "Just browsing",
+        "Wood", "Metal", "Ceramic / pottery", "Melamine / laminate", "Fabric", "Not sure yet",
+        "Nope, first time!", "Done a project or two", "Experienced chalker", "I'm a pro / reseller",
+        "Vintage / distressed", "Smooth & modern", "Rustic farmhouse", "Bold statement colour", "Not sure, advise me",
+    ],
+    'consultation': [
+        "Furniture project", "Kitchen cabinets", "Upcycle / thrift flip", "Wall or feature wall", "Arts, crafts & décor", "Just browsing for inspiration",
+        "Dresser / chest", "Dining table", "Side table / nightstand", "Bookshelf / display", "Bed frame / headboard", "Other furniture",
+        "Cabinet doors", "Countertops", "Open shelving", "Kitchen island", "Full kitchen redo",
+        "Old chair", "Picture frame / mirror", "Wooden box or crate", "Side table or stool", "Thrift store find", "Something else",
+        "Bedroom accent wall", "Living room feature", "Kids room", "Bathroom wall", "Outdoor wall",
+        "Pots or vases", "Canvas or board art", "Home décor accessories", "Stencil project", "Gift or keepsake",
+        "The colours", "Chalk paint technique", "Furniture makeovers", "Someone recommended it", "Just curious",
+        "Bare wood", "Stained or varnished wood", "Melamine / laminate", "Metal", "Ceramic / tiles / glass", "Not sure",
+        "Vintage distressed charm", "Clean modern finish", "Rustic farmhouse", "Bold colour pop", "Soft neutral tones", "Show me what’s trending",
+        "Total beginner", "Done a project or two", "Experienced painter", "Basically a pro",
+    ],
+}
+
+_local = OrderedDict()
+
+def normalize_option(text):
+    text = unicodedata.normalize('NFKC', str(text)).replace('’', "'")
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+WHITELIST = {flow: {normalize_option(opt) for opt in options} for flow, options in GUIDED_OPTIONS.items()}
+
+def cache_key(flow, language, sku, store, history, message):
+    """Key for a guided turn, or None when the conversation is not cacheable.
+
+    history is the full message list before this turn; assistant replies are
+    left out of the key since they were produced from the same answers.
+    """
+    options = WHITELIST.get(flow)
+    if options is None:
+        return None
+    answers = [msg['content'] for msg in history if msg['role'] == 'user']
+    answers.append(message)
+    answers = [normalize_option(answer) for answer in answers]
+    if any(answer not in options for answer in answers):
+        return None
+    parts = [flow, language, sku if flow == 'product' else '', store, answers]
+    digest = hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+    return f'reply:{digest[:32]}'
+
+def get_reply(key):
+    if key in _local:
+        _local.move_to_end(key)
+        return _local[key]
+    try:
+        reply = analytics.store_get(key)
+    except Exception as e:
+        print(f"Reply cache read error: {str(e)}")
+        return None
+    if reply:
+        _remember(key, reply)
+    return reply
+
+def put_reply(key, reply):
+    _remember(key, reply)
+    try:
+        analytics.store_set(key, reply, REPLY_CACHE_TTL)
+    except Exception as e:
+        print(f"Reply cache write error: {str(e)}")
+
+def _remember(key, reply):
+    _local[key] = reply
+    _local.move_to_end(key)
+    while len(_local) > LOCAL_CACHE_SIZE:
+        _local.popitem(last=False)
@@ -0,0 +1,119 @@
+"""Latency-aware model routing for /chat.
+
+A reply is requested from the primary model. If its response has not
+started within CHAT_HEDGE_AFTER seconds, a hedged request goes to the
+fallback model, and whichever starts answering first is used; the other is
+closed, which cancels it upstream. A model that errors or misses the
+deadline BREAKER_FAILURES times in a row is skipped for BREAKER_COOLDOWN
+seconds, so shoppers go straight to the fallback while it is degraded.
+Only timeouts, connection errors and 429/5xx answers count; any other 4xx
+means the request itself is wrong and is raised without failing over.
+
+Requests are always streamed upstream, so "started" means the response
+headers arrived, not that the whole reply was generated.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.error
+
+import _http
+
+PRIMARY_MODEL = os.environ.get('CHAT_MODEL', 'claude-sonnet-4-20250514')
+# Empty disables the fallback; hedges then go to the primary model again
+FALLBACK_MODEL = os.environ.get('CHAT_FALLBACK_MODEL', 'claude-3-5-haiku-20241022')
+HEDGE_AFTER = float(os.environ.get('CHAT_HEDGE_AFTER', '3'))
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 30
+
+_executor = ThreadPoolExecutor(max_workers=4)
+_breakers = {}
+_breaker_lock = threading.Lock()
+
+def available(model):
+    with _breaker_lock:
+        breaker = _breakers.get(model)
+        return not breaker or breaker['open_until'] <= time.time()
+
+def record_success(model):
+    with _breaker_lock:
+        _breakers.pop(model, None)
+
+def record_failure(model):
+    with _breaker_lock:
+        breaker = _breakers.setdefault(model, {'failures': 0, 'open_until': 0})
+        breaker['failures'] += 1
+        if breaker['failures'] >= BREAKER_FAILURES:
+            breaker['open_until'] = time.time() + BREAKER_COOLDOWN
+            breaker['failures'] = 0
+            print(f"Circuit open for {model} ({BREAKER_COOLDOWN}s)")
+
+def route():
+    """(first model to ask, model to hedge or fail over to)."""
+    models = [m for m in dict.fromkeys([PRIMARY_MODEL, FALLBACK_MODEL]) if m and available(m)]
+    if not models:
+        models = [PRIMARY_MODEL]  # everything is tripped; try the primary anyway
+    return models[0], models[-1]
+
+def degraded(error):
+    """Whether an error points at the model rather than at the request."""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+def discard(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def open_reply(url, headers, payload):
+    """(streaming response, model) from whichever model starts answering first.
+
+    payload is the Messages API request without 'model'. Raises the last
+    error when every attempt failed.
+    """
+    first, hedge = route()
+
+    def start(model):
+        body = json.dumps(dict(payload, model=model, stream=True)).encode()
+        # Failover here replaces the client's own retries
+        return _http.post(url, body, headers, stream=True, retries=0)
+
+    started = time.monotonic()
+    pending = {_executor.submit(start, first): first}
+    hedged = False
+    error = None
+    while pending:
+        timeout = None if hedged else max(0, HEDGE_AFTER - (time.monotonic() - started))
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            print(f"No response from {first} after {HEDGE_AFTER}s; hedging to {hedge}")
+            record_failure(first)
+            pending[_executor.submit(start, hedge)] = hedge
+            hedged = True
+            continue
+        for future in done:
+            model = pending.pop(future)
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f"Model {model} failed: {str(e)}")
+                if not degraded(e):
+                    for other in pending:
+                        other.add_done_callback(discard)
+                    raise
+                record_failure(model)
+                error = e
+                continue
+            if model != first or not hedged:
+                record_success(model)
+            for other in pending:
+                other.add_done_callback(discard)
+            return response, model
+        if not hedged and not pending:
+            # The first model failed fast: fail over without waiting
+            pending[_executor.submit(start, hedge)] = hedge
+            hedged = True
+    raise error
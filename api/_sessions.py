@@ -0,0 +1,57 @@
+"""Server-side chat sessions, kept on the analytics storage backend.
+
+A session holds the full message history (for /recap), how many of those
+messages /chat has already folded into the rolling summary, and the
+summary itself. Keys expire CHAT_SESSION_TTL seconds after the last turn.
+
+Sessions are keyed on a random token that /chat issues with its first
+reply and only that browser holds. The analytics session ID is not used:
+it is public in every event the dashboard can read.
+"""
+import json
+import os
+import re
+import secrets
+
+import analytics
+
+SESSION_TTL = int(os.environ.get('CHAT_SESSION_TTL', str(24 * 3600)))
+
+TOKEN_RE = re.compile(r'^[A-Za-z0-9_-]{32}$')
+
+def new_token():
+    return secrets.token_urlsafe(24)
+
+def valid_token(token):
+    return isinstance(token, str) and bool(TOKEN_RE.match(token))
+
+def session_key(token):
+    return f'chat:{token}'
+
+def new_session():
+    return {'history': [], 'start': 0, 'summary': None}
+
+def load_session(token):
+    """The stored session, or None if it is missing, expired or unreadable."""
+    if not valid_token(token):
+        return None
+    try:
+        raw = analytics.store_get(session_key(token))
+        session = json.loads(raw) if raw else None
+    except Exception as e:
+        print(f"Session load error: {str(e)}")
+        return None
+    if not isinstance(session, dict) or not isinstance(session.get('history'), list):
+        return None
+    return session
+
+def save_session(token, session):
+    try:
+        analytics.store_set(session_key(token), json.dumps(session), SESSION_TTL)
+    except Exception as e:
+        # The client can always resync by sending its history
+        print(f"Session save error: {str(e)}")
+
+def in_sync(session, turns):
+    """True when the client's message count matches what the server holds."""
+    return session is not None and len(session['history']) == turns
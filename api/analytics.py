@@ -1,9 +1,25 @@
 from http.server import BaseHTTPRequestHandler
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+import base64
+import csv
+import fcntl
+import gzip
+import heapq
+import io
 import json
 import os
+import random
+import re
+import threading
 import time
-from urllib.request import Request, urlopen
-from urllib.error import URLError
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+from urllib.error import HTTPError, URLError
+
+import _http
 
 # --- Redis via REDIS_URL (primary) ---
 REDIS_URL = os.environ.get('REDIS_URL', '')
@@ -22,12 +38,26 @@ try:
 except ImportError:
     _redis_error = 'redis package not installed'
 
+# 'lists' (per store/day partitions) or 'streams' (one capped Redis Stream).
+# Switching to streams is one-way: existing partitions stay readable.
+REDIS_MODE = os.environ.get('ANALYTICS_REDIS_MODE', 'lists')
+STREAM_KEY = 'stream:events'
+STREAM_MAXLEN = int(os.environ.get('ANALYTICS_STREAM_MAXLEN', '100000'))
+
 # --- Vercel KV REST API (secondary) ---
 KV_REST_API_URL = os.environ.get('KV_REST_API_URL', '')
 KV_REST_API_TOKEN = os.environ.get('KV_REST_API_TOKEN', '')
 
 # Fallback file storage
 EVENTS_FILE = '/tmp/analytics_events.json'
+EVENTS_DIR = '/tmp/analytics_events'
+ROLLUPS_FILE = '/tmp/analytics_rollups.json'
+UNIQUES_DIR = '/tmp/analytics_uniques'
+GUIDED_FILE = '/tmp/analytics_guided.json'
+VERSION_FILE = '/tmp/analytics_version'
+SPILL_FILE = '/tmp/analytics_spill.jsonl'
+ARCHIVE_DIR = '/tmp/analytics_archive'
+STORE_DIR = '/tmp/analytics_store'
 
 def get_storage_type():
     if _redis_client:
@@ -51,27 +81,664 @@ COUNTER_MAP = {
     'discount_copy': 'count:discount_copy',
 }
 
-# --- Redis client operations ---
-def redis_write_event(event):
-    event_json = json.dumps(event)
-    pipe = _redis_client.pipeline()
-    pipe.rpush('events', event_json)
-    counter_key = COUNTER_MAP.get(event.get('event_type'))
-    if counter_key:
-        pipe.incr(counter_key)
-    pipe.ltrim('events', -10000, -1)
-    pipe.execute()
+# --- Compact event encoding ---
+# Stored events are version-tagged JSON arrays instead of keyed objects:
+#   [2, server_ms, type, store, sessionId, client, timestamp, event_data]
+# with known event types interned as small ints and the client's ISO
+# timestamp as epoch ms when it round-trips exactly. A client timestamp
+# that is itself a number (or a list) is stored wrapped as [value], so it
+# comes back unchanged; version 1 stored it bare and read it back as epoch
+# ms, and those events still decode that way. Anything starting with '{' is a pre-compact JSON event.
+# ANALYTICS_ENCODING=json keeps writing the old format. Event reads decode
+# to keyed objects unless the reader asks for encoding=compact, which sends
+# the stored strings as they are, with EVENT_CODES alongside (the dashboard).
+COMPACT_EVENTS = os.environ.get('ANALYTICS_ENCODING', 'compact') != 'json'
+COMPACT_VERSION = 2
+# Append only: stored events refer to types by index
+EVENT_CODES = (
+    'scan', 'lead_submit', 'recipe_tap', 'whatsapp_send', 'chat_message',
+    'promo_shown', 'promo_click', 'promo_dismiss', 'guided_answer',
+    'email_share', 'discount_copy', 'promo_unclick',
+)
+EVENT_CODE_INDEX = {name: code for code, name in enumerate(EVENT_CODES)}
+COMPACT_TIME_RE = re.compile(r'^\[[12],(-?\d+),')
+
+def iso_ms(ms):
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def encode_timestamp(value):
+    if isinstance(value, str) and len(value) == 24 and value.endswith('Z'):
+        try:
+            ms = round(datetime.fromisoformat(value[:-1] + '+00:00').timestamp() * 1000)
+        except ValueError:
+            return value
+        if iso_ms(ms) == value:
+            return ms
+    # Wrapped so it can't be mistaken for the epoch ms form above
+    return [value] if isinstance(value, (int, list)) else value
+
+def decode_timestamp(version, value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return iso_ms(value)
+    if version >= 2 and isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return value
+
+def encode_event(event):
+    if not COMPACT_EVENTS:
+        return json.dumps(event)
+    event_type = str(event.get('event_type', ''))
+    return json.dumps([
+        COMPACT_VERSION,
+        round(event['server_time'] * 1000),
+        EVENT_CODE_INDEX.get(event_type, event_type),
+        event.get('store', ''),
+        event.get('sessionId', ''),
+        event.get('client', 'direct'),
+        encode_timestamp(event.get('timestamp', '')),
+        event.get('event_data', {}),
+    ] + ([event['sample_weight']] if 'sample_weight' in event else []), separators=(',', ':'))
+
+# --- Raw event sampling ---
+# High-volume types that are only ever counted keep exact counters, rollups
+# and promo cells, but only a sample of their raw events is stored, each
+# carrying sample_weight = 1 / rate so readers can scale estimates back up.
+# ANALYTICS_SAMPLE_RATES overrides the defaults, e.g. 'chat_message=0.2'.
+def parse_sample_rates(value):
+    rates = {}
+    for rule in value.split(','):
+        name, _, rate = rule.partition('=')
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+SAMPLE_RATES = parse_sample_rates(os.environ.get('ANALYTICS_SAMPLE_RATES', 'chat_message=0.1,promo_shown=0.25'))
+
+def sample_event(event):
+    """The event to store raw (weighted if sampled), or None to skip it."""
+    rate = SAMPLE_RATES.get(event.get('event_type'), 1.0)
+    if rate >= 1.0:
+        return event
+    if rate <= 0.0 or random.random() >= rate:
+        return None
+    weighted = {k: v for k, v in event.items() if k != 'server_time'}
+    weighted['sample_weight'] = round(1 / rate, 3)
+    # server_time stays the last key for SERVER_TIME_RE
+    weighted['server_time'] = event['server_time']
+    return weighted
+
+def decode_item(item):
+    """Stored string (compact or JSON) -> event dict."""
+    value = json.loads(item)
+    if not isinstance(value, list):
+        return value
+    version, server_ms, event_type, store, session_id, client, timestamp, event_data = value[:8]
+    event = {
+        'sessionId': session_id,
+        'store': store,
+        'event_type': EVENT_CODES[event_type] if isinstance(event_type, int) else event_type,
+        'event_data': event_data,
+        'client': client,
+        'timestamp': decode_timestamp(version, timestamp),
+    }
+    if len(value) > 8:
+        event['sample_weight'] = value[8]
+    event['server_time'] = server_ms / 1000
+    return event
+
+def json_item(item):
+    """Stored string -> the JSON object form the dashboard reads."""
+    if item.startswith('['):
+        return json.dumps(decode_item(item))
+    return item
+
+# --- Event partitions ---
+# Raw events live in one list per store and UTC day, so a store/date-range
+# read only touches the matching slices. The rollup indexes agg:stores and
+# agg:days double as the partition index. The pre-partitioning global
+# 'events' list is fanned out into partitions on first read.
+EVENT_CAP = 10000
+LEGACY_EVENTS_KEY = 'events'
+
+def partition_key(store, day):
+    return f'events:{store}:{day}'
+
+def parse_time(value, end=False):
+    """Epoch seconds, YYYY-MM-DD (UTC) or ISO 8601 -> epoch seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if len(value) == 10:
+        day = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        return (day + timedelta(days=1)).timestamp() - 0.001 if end else day.timestamp()
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def partition_days(known_days, start=None, end=None):
+    lo = utc_day(start) if start is not None else ''
+    hi = utc_day(end) if end is not None else '9999-12-31'
+    return sorted(day for day in known_days if lo <= day <= hi)
+
+def in_window(event, start=None, end=None):
+    ts = event.get('server_time', 0)
+    return (start is None or ts >= start) and (end is None or ts <= end)
+
+# server_time is the last key json.dumps writes, so it can be read off the
+# end of a stored string without decoding the whole event.
+SERVER_TIME_RE = re.compile(r'"server_time":\s*([-+0-9.eE]+)\}\s*$')
+PAGE_SIZE = 1000
+
+def raw_time(item):
+    match = COMPACT_TIME_RE.match(item) or SERVER_TIME_RE.search(item)
+    if match:
+        return float(match.group(1)) / (1000 if item.startswith('[') else 1)
+    try:
+        return float(decode_item(item).get('server_time', 0))
+    except (json.JSONDecodeError, TypeError, ValueError, AttributeError):
+        return 0.0
+
+def merge_partitions(partitions_by_day, start=None, end=None, cursor=None):
+    """Merge per-store raw item iterators day by day in server_time order."""
+    for day in sorted(partitions_by_day):
+        for item in heapq.merge(*partitions_by_day[day], key=raw_time):
+            ts = raw_time(item)
+            if (start is None or ts >= start) and (end is None or ts <= end):
+                if cursor is not None:
+                    cursor['value'] = repr(ts)
+                yield item.rstrip('\n')
+
+# --- Tiered retention ---
+# Partitions older than HOT_DAYS are moved out of the hot lists into
+# gzip-compressed NDJSON archive segments (one segment per compaction run,
+# base64 in Redis/KV, concatenated gzip members on disk). The per-day
+# rollups are never compacted, so summary ranges stay exact, and event
+# reads chain a day's archive segments in front of its hot partition.
+HOT_DAYS = int(os.environ.get('ANALYTICS_HOT_DAYS', '14'))
+
+def archive_key(store, day):
+    return f'archive:{store}:{day}'
+
+def pack_segment(items):
+    data = ''.join(item.rstrip('\n') + '\n' for item in items).encode()
+    return base64.b64encode(gzip.compress(data)).decode()
+
+def unpack_segments(segments):
+    for segment in segments or []:
+        for line in gzip.decompress(base64.b64decode(segment)).decode().splitlines():
+            if line:
+                yield line
+
+# Newest day whose hot lists have been archived; later runs start after it
+COMPACTED_KEY = 'archive:compacted'
+
+def compaction_cutoff(hot_days):
+    """First UTC day that stays hot."""
+    return (datetime.now(timezone.utc).date() - timedelta(days=hot_days)).isoformat()
+
+# --- Incremental read cursors ---
+# A cursor is a Redis Stream entry id in streams mode and a server_time
+# everywhere else. Time cursors re-read a short overlap so events from a
+# slow concurrent write are not skipped; clients de-duplicate.
+CURSOR_OVERLAP = 5.0
+STREAM_ID_RE = re.compile(r'^\d+-\d+$')
+
+def cursor_time(cursor):
+    if STREAM_ID_RE.match(cursor):
+        return int(cursor.split('-')[0]) / 1000.0
+    return float(cursor)
+
+def cursor_stream_id(cursor):
+    if STREAM_ID_RE.match(cursor):
+        return cursor
+    return '%d-0' % int(float(cursor) * 1000)
 
-def redis_read_events():
-    items = _redis_client.lrange('events', 0, -1)
+def decode_events(items, start=None, end=None):
     events = []
-    for item in items:
+    for item in items or []:
         try:
-            events.append(json.loads(item))
-        except (json.JSONDecodeError, TypeError):
-            pass
+            event = decode_item(item)
+        except (json.JSONDecodeError, TypeError, ValueError, IndexError):
+            continue
+        if in_window(event, start, end):
+            events.append(event)
     return events
 
+def group_by_partition(events):
+    partitions = {}
+    for event in events:
+        if not isinstance(event, dict) or 'server_time' not in event:
+            continue
+        key = partition_key(event.get('store', ''), utc_day(event['server_time']))
+        partitions.setdefault(key, []).append(event)
+    return partitions
+
+# --- Dashboard rollups ---
+# Per store/day hashes of event_type -> count (plus 'revenue' and
+# 'consultations'), updated in the same round trip as the raw event so the
+# summary view never has to scan the event list. The '*' store holds the
+# all-stores total for each day. Unique sessions go into per store/day
+# HyperLogLogs (uniq:{store}:{day}), so a range's distinct visitor count is
+# one PFCOUNT over the union in ~12 KB per key.
+HOST_BRAND = "Granny B's"
+PROMO_RATES = {'promo_shown': 0.50, 'promo_click': 2.00}
+CONSULTATION_ANSWERS = 4
+GUIDED_TTL = 2 * 86400
+ALL_STORES = '*'
+# UTC days ending today; the dashboard's raw-event window uses the same days
+RANGE_DAYS = {'today': 1, '7days': 7, '30days': 30}
+
+def utc_day(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+
+def rollup_key(store, day):
+    return f'agg:{store}:{day}'
+
+def uniques_key(store, day):
+    return f'uniq:{store}:{day}'
+
+def session_key(session_id):
+    return f'sess:{session_id}:guided'
+
+def promo_revenue(event):
+    rate = PROMO_RATES.get(event.get('event_type'))
+    data = event.get('event_data') or {}
+    brand = data.get('brand') if isinstance(data, dict) else None
+    if rate and brand and brand != HOST_BRAND:
+        return rate
+    return 0
+
+def rollup_commands(event):
+    day = utc_day(event['server_time'])
+    event_type = event.get('event_type') or 'unknown'
+    revenue = promo_revenue(event)
+    commands = [
+        ['SET', 'agg:since', event['server_time'], 'NX'],
+        ['SADD', 'agg:days', day],
+        ['SADD', 'agg:stores', event.get('store', '')],
+    ]
+    for store in (event.get('store', ''), ALL_STORES):
+        key = rollup_key(store, day)
+        commands.append(['HINCRBY', key, event_type, 1])
+        if revenue:
+            commands.append(['HINCRBYFLOAT', key, 'revenue', revenue])
+        if event.get('sessionId'):
+            commands.append(['PFADD', uniques_key(store, day), event['sessionId']])
+    return commands
+
+def guided_commands(event):
+    """Per-session guided answer counter; the first reply is the new count."""
+    if event.get('event_type') != 'guided_answer' or not event.get('sessionId'):
+        return []
+    # Expiring per-session key, so a session spanning midnight counts once
+    key = session_key(event['sessionId'])
+    return [['INCR', key], ['EXPIRE', key, GUIDED_TTL]]
+
+def consultation_commands(event, guided_count):
+    # Only the answer that crosses the threshold counts, so repeat answers
+    # from the same session never add a second consultation.
+    if guided_count != CONSULTATION_ANSWERS:
+        return []
+    day = utc_day(event['server_time'])
+    return [['HINCRBY', rollup_key(store, day), 'consultations', 1]
+            for store in (event.get('store', ''), ALL_STORES)]
+
+def range_days(range_name, known_days):
+    if range_name not in RANGE_DAYS:
+        return sorted(known_days)
+    today = datetime.now(timezone.utc).date()
+    span = RANGE_DAYS[range_name]
+    return [(today - timedelta(days=n)).isoformat() for n in range(span - 1, -1, -1)]
+
+def merge_rollups(hashes):
+    totals = {}
+    for h in hashes:
+        for field, val in (h or {}).items():
+            try:
+                num = float(val)
+            except (TypeError, ValueError):
+                continue
+            totals[field] = totals.get(field, 0) + num
+    revenue = round(totals.pop('revenue', 0), 2)
+    consultations = int(totals.pop('consultations', 0))
+    return {
+        'totals': {k: int(v) for k, v in totals.items()},
+        'consultations': consultations,
+        'revenue': revenue,
+    }
+
+# --- Promo attribution cube ---
+# promo:{store}:{day} hashes keyed 'brand|product|metric', written with the
+# rollups so supplier reporting outlives the raw event trim. view_ms sums
+# viewDuration over dismissals (average = view_ms / dismiss).
+PROMO_METRICS = {'promo_shown': 'shown', 'promo_click': 'click', 'promo_dismiss': 'dismiss'}
+
+def promo_key(store, day):
+    return f'promo:{store}:{day}'
+
+def promo_commands(event):
+    metric = PROMO_METRICS.get(event.get('event_type'))
+    if not metric:
+        return []
+    data = event.get('event_data') if isinstance(event.get('event_data'), dict) else {}
+    cell = '%s|%s|' % (data.get('brand') or 'Unknown', data.get('product') or 'Unknown')
+    increments = [(metric, 1)]
+    if metric == 'click':
+        increments.append(('click_summary' if data.get('source') == 'summary' else 'click_card', 1))
+    elif metric == 'dismiss':
+        try:
+            increments.append(('view_ms', int(data.get('viewDuration') or 0)))
+        except (TypeError, ValueError):
+            pass
+    day = utc_day(event['server_time'])
+    commands = [['SET', 'promo:since', event['server_time'], 'NX']]
+    for store in (event.get('store', ''), ALL_STORES):
+        for field, amount in increments:
+            commands.append(['HINCRBY', promo_key(store, day), cell + field, amount])
+    return commands
+
+def backfill_promos(events, since, commands_for=promo_commands):
+    """Cube commands for events stored before the cube existed."""
+    commands = []
+    for event in events:
+        if isinstance(event, dict) and 'server_time' in event and (since is None or event['server_time'] < since):
+            commands.extend(commands_for(event)[1:])
+    return commands
+
+# --- Guided answer cube ---
+# answers:{store}:{day} hashes keyed 'question|answer', so the dashboard's
+# guided breakdown is read like the promo table instead of from raw events.
+def answer_key(store, day):
+    return f'answers:{store}:{day}'
+
+def answer_commands(event):
+    if event.get('event_type') != 'guided_answer':
+        return []
+    data = event.get('event_data') if isinstance(event.get('event_data'), dict) else {}
+    cell = '%s|%s' % (data.get('question') or 'Unknown', data.get('answer') or 'Unknown')
+    day = utc_day(event['server_time'])
+    commands = [['SET', 'answers:since', event['server_time'], 'NX']]
+    for store in (event.get('store', ''), ALL_STORES):
+        commands.append(['HINCRBY', answer_key(store, day), cell, 1])
+    return commands
+
+def backfill_answers(events, since):
+    return backfill_promos(events, since, answer_commands)
+
+def merge_answers(hashes):
+    """{question: {answer: count}}, most answered question first."""
+    questions = {}
+    for h in hashes:
+        for field, val in (h or {}).items():
+            try:
+                question, answer = field.rsplit('|', 1)
+                num = int(val)
+            except (TypeError, ValueError):
+                continue
+            answers = questions.setdefault(question, {})
+            answers[answer] = answers.get(answer, 0) + num
+    return dict(sorted(questions.items(), key=lambda item: -sum(item[1].values())))
+
+def merge_promos(hashes):
+    cells = {}
+    for h in hashes:
+        for field, val in (h or {}).items():
+            try:
+                brand, rest = field.split('|', 1)
+                product, metric = rest.rsplit('|', 1)
+                num = int(val)
+            except (TypeError, ValueError):
+                continue
+            row = cells.setdefault((brand, product), {
+                'brand': brand, 'product': product, 'shown': 0, 'click': 0,
+                'click_card': 0, 'click_summary': 0, 'dismiss': 0, 'view_ms': 0})
+            row[metric] = row.get(metric, 0) + num
+    return sorted(cells.values(), key=lambda row: (-row['shown'], row['brand'], row['product']))
+
+def backfill_rollups(events, since):
+    """Rollup commands for events stored before write-time rollups existed."""
+    commands = []
+    sessions = {}
+    for event in events:
+        if not isinstance(event, dict) or 'server_time' not in event:
+            continue
+        if since is not None and event['server_time'] >= since:
+            continue
+        commands.extend(rollup_commands(event)[1:])
+        if guided_commands(event):
+            sid = event['sessionId']
+            sessions[sid] = sessions.get(sid, 0) + 1
+            commands.extend(consultation_commands(event, sessions[sid]))
+    return commands
+
+# --- Batched writes ---
+MAX_BATCH = 200
+# Bumped in the same round trip as every write batch; GET derives its ETag
+# from it so an unchanged dashboard revalidates with one key read.
+VERSION_KEY = 'analytics:version'
+
+def event_commands(event, streams=False):
+    raw = sample_event(event)
+    if raw is None:
+        commands = []
+    elif streams:
+        # Approximate trimming lets Redis drop whole macro nodes cheaply
+        commands = [['XADD', STREAM_KEY, 'MAXLEN', '~', STREAM_MAXLEN, '*',
+                     's', event.get('store', ''), 'e', encode_event(raw)]]
+    else:
+        key = partition_key(event.get('store', ''), utc_day(event['server_time']))
+        commands = [['RPUSH', key, encode_event(raw)], ['LTRIM', key, -EVENT_CAP, -1]]
+    counter_key = COUNTER_MAP.get(event.get('event_type'))
+    if counter_key:
+        commands.append(['INCR', counter_key])
+    commands.extend(rollup_commands(event))
+    commands.extend(promo_commands(event))
+    commands.extend(answer_commands(event))
+    return commands
+
+def batch_commands(events, streams=False):
+    """Write commands for a batch, plus (event, reply index) per guided answer."""
+    commands = []
+    guided = []
+    for event in events:
+        commands.extend(event_commands(event, streams))
+        answer = guided_commands(event)
+        if answer:
+            guided.append((event, len(commands)))
+            commands.extend(answer)
+    commands.append(['INCR', VERSION_KEY])
+    return commands, guided
+
+def follow_up_commands(guided, replies):
+    commands = []
+    for event, index in guided:
+        commands.extend(consultation_commands(event, int(replies[index] or 0)))
+    if commands:
+        commands.append(['INCR', VERSION_KEY])
+    return commands
+
+# --- Redis client operations ---
+def redis_write_events(events):
+    commands, guided = batch_commands(events, streams=REDIS_MODE == 'streams')
+    pipe = _redis_client.pipeline()
+    for command in commands:
+        pipe.execute_command(*command)
+    results = pipe.execute()
+    follow_up = follow_up_commands(guided, results)
+    if follow_up:
+        pipe = _redis_client.pipeline()
+        for command in follow_up:
+            pipe.execute_command(*command)
+        pipe.execute()
+
+def redis_ensure_rollups():
+    redis_migrate_legacy()
+    if not _redis_client.set('agg:backfilled', 1, nx=True):
+        return
+    since = _redis_client.get('agg:since')
+    commands = backfill_rollups(decode_events(redis_iter_events()), float(since) if since else None)
+    pipe = _redis_client.pipeline()
+    for command in commands:
+        pipe.execute_command(*command)
+    pipe.execute()
+
+def redis_read_rollups(store, range_name, key=rollup_key):
+    redis_ensure_rollups()
+    days = range_days(range_name, _redis_client.smembers('agg:days'))
+    pipe = _redis_client.pipeline()
+    for day in days:
+        pipe.hgetall(key(store, day))
+    return days, pipe.execute()
+
+def redis_count_uniques(store, days):
+    if not days:
+        return 0
+    return _redis_client.pfcount(*[uniques_key(store, day) for day in days])
+
+def redis_ensure_cube(name, backfill):
+    if not _redis_client.set(f'{name}:backfilled', 1, nx=True):
+        return
+    since = _redis_client.get(f'{name}:since')
+    commands = backfill(decode_events(redis_iter_events()), float(since) if since else None)
+    pipe = _redis_client.pipeline()
+    for command in commands:
+        pipe.execute_command(*command)
+    pipe.execute()
+
+def redis_read_promos(store, range_name):
+    redis_ensure_cube('promo', backfill_promos)
+    return redis_read_rollups(store, range_name, promo_key)
+
+def redis_read_answers(store, range_name):
+    redis_ensure_cube('answers', backfill_answers)
+    return redis_read_rollups(store, range_name, answer_key)
+
+def redis_migrate_legacy():
+    # RENAME is atomic, so only one concurrent reader performs the fan-out
+    try:
+        _redis_client.rename(LEGACY_EVENTS_KEY, 'events:migrating')
+    except _redis_mod.ResponseError:
+        return
+    legacy = decode_events(_redis_client.lrange('events:migrating', 0, -1))
+    pipe = _redis_client.pipeline()
+    for key, events in group_by_partition(legacy).items():
+        # Legacy events are older than anything already partitioned
+        pipe.lpush(key, *[json.dumps(e) for e in reversed(events)])
+        _, store, day = key.split(':', 2)
+        pipe.sadd('agg:stores', store)
+        pipe.sadd('agg:days', day)
+    pipe.delete('events:migrating')
+    pipe.execute()
+
+def redis_iter_partition(key):
+    offset = 0
+    while True:
+        page = _redis_client.lrange(key, offset, offset + PAGE_SIZE - 1)
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        offset += PAGE_SIZE
+
+def redis_iter_archive(store, day):
+    yield from unpack_segments(_redis_client.lrange(archive_key(store, day), 0, -1))
+
+def redis_iter_events(store=None, start=None, end=None, cursor=None):
+    redis_migrate_legacy()
+    pipe = _redis_client.pipeline()
+    pipe.smembers('agg:stores')
+    pipe.smembers('agg:days')
+    pipe.smembers('archive:days')
+    stores, days, archived = pipe.execute()
+    stores = [store] if store else sorted(stores)
+    partitions = {}
+    for day in partition_days(days, start, end):
+        for s in stores:
+            hot = redis_iter_partition(partition_key(s, day))
+            partitions.setdefault(day, []).append(
+                chain(redis_iter_archive(s, day), hot) if day in archived else hot)
+    return merge_partitions(partitions, start, end, cursor)
+
+def redis_compact(hot_days):
+    redis_migrate_legacy()
+    cutoff = compaction_cutoff(hot_days)
+    stats = {'partitions': 0, 'events': 0}
+    if REDIS_MODE == 'streams':
+        cutoff_ms = int(datetime.fromisoformat(cutoff).replace(tzinfo=timezone.utc).timestamp() * 1000)
+        groups = {}
+        for item in redis_iter_stream(end=cutoff_ms / 1000.0 - 0.001):
+            event = decode_item(item)
+            groups.setdefault((event.get('store', ''), utc_day(event['server_time'])), []).append(item)
+        pipe = _redis_client.pipeline(transaction=True)
+        for (store, day), items in groups.items():
+            pipe.rpush(archive_key(store, day), pack_segment(items))
+            pipe.sadd('archive:days', day)
+            stats['partitions'] += 1
+            stats['events'] += len(items)
+        pipe.xtrim(STREAM_KEY, minid=cutoff_ms, approximate=False)
+        pipe.execute()
+    pipe = _redis_client.pipeline()
+    pipe.smembers('agg:stores')
+    pipe.smembers('agg:days')
+    pipe.get(COMPACTED_KEY)
+    stores, days, compacted = pipe.execute()
+    for day in sorted(d for d in days if (compacted or '') < d < cutoff):
+        for store in stores:
+            key = partition_key(store, day)
+            items = _redis_client.lrange(key, 0, -1)
+            if not items:
+                continue
+            pipe = _redis_client.pipeline(transaction=True)
+            pipe.rpush(archive_key(store, day), pack_segment(items))
+            pipe.sadd('archive:days', day)
+            # Trim only what was archived, in case anything was appended since
+            pipe.ltrim(key, len(items), -1)
+            pipe.execute()
+            stats['partitions'] += 1
+            stats['events'] += len(items)
+        _redis_client.set(COMPACTED_KEY, day)
+    return stats
+
+def redis_iter_stream(store=None, start=None, end=None, since=None, cursor=None):
+    lo = '%d' % (start * 1000) if start is not None else '-'
+    # Resume after the cursor unless the window starts later than it
+    if since and (start is None or cursor_time(since) * 1000 >= int(start * 1000)):
+        lo = '(' + cursor_stream_id(since)
+    hi = '%d' % (end * 1000) if end is not None else '+'
+    while True:
+        page = _redis_client.xrange(STREAM_KEY, lo, hi, count=PAGE_SIZE)
+        for entry_id, fields in page:
+            if cursor is not None:
+                # Advance past entries filtered out by store as well
+                cursor['value'] = entry_id
+            if not store or fields.get('s') == store:
+                yield fields.get('e', '')
+        if len(page) < PAGE_SIZE:
+            return
+        lo = '(' + page[-1][0]
+
+def redis_iter_stream_events(store=None, start=None, end=None, since=None, cursor=None):
+    stream = redis_iter_stream(store, start, end, since, cursor)
+    if since:
+        return stream
+    # Partitions written before the switch to streams are older than the stream
+    return heapq.merge(redis_iter_events(store, start, end), stream, key=raw_time)
+
+def redis_read_version():
+    return _redis_client.get(VERSION_KEY)
+
+def redis_store_get(key):
+    return _redis_client.get(key)
+
+def redis_store_set(key, value, ttl):
+    _redis_client.set(key, value, ex=ttl)
+
+def redis_wait_stream(timeout):
+    # Under the client's 5 s socket timeout; callers re-check the version
+    _redis_client.xread({STREAM_KEY: '$'}, block=int(min(timeout, 4.0) * 1000), count=1)
+
 def redis_read_counters():
     pipe = _redis_client.pipeline()
     for key in COUNTER_MAP.values():
@@ -83,90 +750,579 @@ def redis_read_counters():
     return counters
 
 # --- KV REST API operations ---
-def kv_request(commands):
-    url = KV_REST_API_URL + '/pipeline'
-    body = json.dumps(commands).encode()
-    req = Request(url, data=body, method='POST')
-    req.add_header('Authorization', 'Bearer ' + KV_REST_API_TOKEN)
-    req.add_header('Content-Type', 'application/json')
-    resp = urlopen(req, timeout=5)
+# Requests go through the shared client in _http.py, so warm invocations
+# reuse its keep-alive connections and a stale one is only retried while
+# the request is unwritten. Nothing else is retried: a pipeline of
+# INCR/RPUSH must not run twice. Pages of large partitions are fetched in
+# parallel on a small thread pool sharing those connections.
+KV_POOL_SIZE = 4
+_kv_executor = None
+
+def kv_post(path, payload, timeout):
+    headers = {
+        'Authorization': 'Bearer ' + KV_REST_API_TOKEN,
+        'Content-Type': 'application/json',
+    }
+    try:
+        resp = _http.post(KV_REST_API_URL.rstrip('/') + path, json.dumps(payload).encode(), headers,
+                          retries=0, timeout=(5, timeout))
+    except HTTPError as e:
+        # Keep the REST API's error text (e.g. WRONGTYPE) in the message
+        raise HTTPError(e.url, e.code, e.read().decode('utf-8', 'replace'), e.headers, None)
     return json.loads(resp.read())
 
+def kv_request(commands):
+    return kv_post('/pipeline', [[str(arg) for arg in command] for command in commands], timeout=5)
+
 def kv_single(command):
-    url = KV_REST_API_URL
-    body = json.dumps(command).encode()
-    req = Request(url, data=body, method='POST')
-    req.add_header('Authorization', 'Bearer ' + KV_REST_API_TOKEN)
-    req.add_header('Content-Type', 'application/json')
-    resp = urlopen(req, timeout=10)
-    data = json.loads(resp.read())
-    return data.get('result')
-
-def kv_write_event(event):
-    event_json = json.dumps(event)
-    commands = [['RPUSH', 'events', event_json]]
-    counter_key = COUNTER_MAP.get(event.get('event_type'))
-    if counter_key:
-        commands.append(['INCR', counter_key])
-    commands.append(['LTRIM', 'events', '-10000', '-1'])
+    return kv_post('', [str(arg) for arg in command], timeout=10).get('result')
+
+def kv_submit(command):
+    global _kv_executor
+    if _kv_executor is None:
+        _kv_executor = ThreadPoolExecutor(max_workers=KV_POOL_SIZE)
+    return _kv_executor.submit(kv_single, command)
+
+def kv_write_events(events):
+    commands, guided = batch_commands(events)
+    results = kv_request(commands)
+    replies = [r.get('result') if isinstance(r, dict) else None for r in results]
+    follow_up = follow_up_commands(guided, replies)
+    if follow_up:
+        kv_request(follow_up)
+
+def kv_migrate_legacy():
+    try:
+        kv_single(['RENAME', LEGACY_EVENTS_KEY, 'events:migrating'])
+    except URLError:
+        # The REST API answers 400 when there is no legacy list to rename
+        return
+    legacy = decode_events(kv_single(['LRANGE', 'events:migrating', '0', '-1']))
+    commands = []
+    for key, events in group_by_partition(legacy).items():
+        commands.append(['LPUSH', key] + [json.dumps(e) for e in reversed(events)])
+        _, store, day = key.split(':', 2)
+        commands.append(['SADD', 'agg:stores', store])
+        commands.append(['SADD', 'agg:days', day])
+    commands.append(['DEL', 'events:migrating'])
     kv_request(commands)
 
-def kv_read_events():
-    result = kv_single(['LRANGE', 'events', '0', '-1'])
-    if not result:
-        return []
-    events = []
-    for item in result:
-        try:
-            events.append(json.loads(item))
-        except (json.JSONDecodeError, TypeError):
-            pass
-    return events
+def kv_iter_partition(key, length):
+    """Yield a partition in order, keeping up to KV_POOL_SIZE pages in flight."""
+    pending = deque()
+    for offset in range(0, length, PAGE_SIZE):
+        pending.append(kv_submit(['LRANGE', key, offset, offset + PAGE_SIZE - 1]))
+        if len(pending) >= KV_POOL_SIZE:
+            yield from pending.popleft().result() or []
+    while pending:
+        yield from pending.popleft().result() or []
+
+def kv_iter_archive(store, day):
+    yield from unpack_segments(kv_single(['LRANGE', archive_key(store, day), '0', '-1']))
+
+def kv_iter_events(store=None, start=None, end=None, cursor=None):
+    kv_migrate_legacy()
+    stores, days, archived = [r.get('result') or [] for r in kv_request(
+        [['SMEMBERS', 'agg:stores'], ['SMEMBERS', 'agg:days'], ['SMEMBERS', 'archive:days']])]
+    stores = [store] if store else sorted(stores)
+    keys = [(day, s) for day in partition_days(days, start, end) for s in stores]
+    if not keys:
+        return iter(())
+    # One round trip for every partition length, then page by index
+    lengths = kv_request([['LLEN', partition_key(s, day)] for day, s in keys])
+    partitions = {}
+    for (day, s), reply in zip(keys, lengths):
+        length = int(reply.get('result') or 0)
+        hot = kv_iter_partition(partition_key(s, day), length)
+        if day in archived:
+            partitions.setdefault(day, []).append(chain(kv_iter_archive(s, day), hot))
+        elif length:
+            partitions.setdefault(day, []).append(hot)
+    return merge_partitions(partitions, start, end, cursor)
+
+def kv_compact(hot_days):
+    kv_migrate_legacy()
+    cutoff = compaction_cutoff(hot_days)
+    stats = {'partitions': 0, 'events': 0}
+    stores, days, compacted = [r.get('result') for r in kv_request([
+        ['SMEMBERS', 'agg:stores'], ['SMEMBERS', 'agg:days'], ['GET', COMPACTED_KEY]])]
+    for day in sorted(d for d in days or [] if (compacted or '') < d < cutoff):
+        for store in stores or []:
+            key = partition_key(store, day)
+            items = kv_single(['LRANGE', key, '0', '-1'])
+            if not items:
+                continue
+            kv_request([
+                ['RPUSH', archive_key(store, day), pack_segment(items)],
+                ['SADD', 'archive:days', day],
+                ['LTRIM', key, len(items), -1],
+            ])
+            stats['partitions'] += 1
+            stats['events'] += len(items)
+        kv_single(['SET', COMPACTED_KEY, day])
+    return stats
+
+def kv_store_get(key):
+    return kv_single(['GET', key])
+
+def kv_store_set(key, value, ttl):
+    kv_single(['SET', key, value, 'EX', ttl])
+
+def kv_read_version():
+    return kv_single(['GET', VERSION_KEY])
+
+def kv_hash(flat):
+    # The REST API returns HGETALL as a flat [field, value, ...] list
+    if isinstance(flat, dict):
+        return flat
+    flat = flat or []
+    return dict(zip(flat[0::2], flat[1::2]))
+
+def kv_ensure_rollups():
+    kv_migrate_legacy()
+    results = kv_request([['SET', 'agg:backfilled', '1', 'NX'], ['GET', 'agg:since']])
+    if not results[0].get('result'):
+        return
+    since = results[1].get('result')
+    commands = backfill_rollups(decode_events(kv_iter_events()), float(since) if since else None)
+    if commands:
+        kv_request(commands)
+
+def kv_read_rollups(store, range_name, key=rollup_key):
+    kv_ensure_rollups()
+    days = range_days(range_name, kv_single(['SMEMBERS', 'agg:days']) or [])
+    if not days:
+        return days, []
+    results = kv_request([['HGETALL', key(store, day)] for day in days])
+    return days, [kv_hash(r.get('result')) for r in results]
+
+def kv_count_uniques(store, days):
+    if not days:
+        return 0
+    return int(kv_single(['PFCOUNT'] + [uniques_key(store, day) for day in days]) or 0)
+
+def kv_ensure_cube(name, backfill):
+    results = kv_request([['SET', f'{name}:backfilled', '1', 'NX'], ['GET', f'{name}:since']])
+    if not results[0].get('result'):
+        return
+    since = results[1].get('result')
+    commands = backfill(decode_events(kv_iter_events()), float(since) if since else None)
+    if commands:
+        kv_request(commands)
+
+def kv_read_promos(store, range_name):
+    kv_ensure_cube('promo', backfill_promos)
+    return kv_read_rollups(store, range_name, promo_key)
+
+def kv_read_answers(store, range_name):
+    kv_ensure_cube('answers', backfill_answers)
+    return kv_read_rollups(store, range_name, answer_key)
 
 def kv_read_counters():
-    commands = [['GET', key] for key in COUNTER_MAP.values()]
-    results = kv_request(commands)
-    counters = {}
     keys = list(COUNTER_MAP.values())
-    for i, r in enumerate(results):
-        val = r.get('result') if isinstance(r, dict) else None
-        counters[keys[i]] = int(val) if val else 0
+    results = kv_single(['MGET'] + keys) or []
+    counters = {}
+    for key, val in zip(keys, results):
+        counters[key] = int(val) if val else 0
     return counters
 
 # --- Fallback file storage ---
-def file_read_events():
+# Each store/day partition is an append-only JSONL log. Writers hold an
+# exclusive flock while appending, and once a segment reaches EVENT_CAP
+# lines it is rotated to '<day>.jsonl.1' (replacing the previous one), so
+# ingestion cost does not depend on how full the partition is.
+def safe_name(value):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', value or '') or '_'
+
+def file_partition_path(store, day):
+    return os.path.join(EVENTS_DIR, safe_name(store), day + '.jsonl')
+
+# path -> (inode, bytes counted, lines), so line counts only scan new appends
+_segment_lines = {}
+
+def file_segment_lines(f, path):
+    st = os.fstat(f.fileno())
+    ino, size, lines = _segment_lines.get(path, (None, 0, 0))
+    if ino != st.st_ino or size > st.st_size:
+        size, lines = 0, 0
+    f.seek(size)
+    for chunk in iter(lambda: f.read(65536), b''):
+        lines += chunk.count(b'\n')
+    _segment_lines[path] = (st.st_ino, f.tell(), lines)
+    return lines
+
+def file_append_lines(path, lines):
+    data = ''.join(line + '\n' for line in lines).encode()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while True:
+        with open(path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(f.fileno()).st_ino:
+                continue  # rotated by another writer while we waited for the lock
+            count = file_segment_lines(f, path)
+            if count >= EVENT_CAP:
+                os.replace(path, path + '.1')
+                continue
+            f.write(data)
+            f.flush()
+            _segment_lines[path] = (os.fstat(f.fileno()).st_ino, f.tell(), count + len(lines))
+            return
+
+def file_iter_partition(path):
+    """Yield raw JSON lines from a partition, oldest segment first."""
+    # No lock here: appends land as whole lines, and a torn trailing line
+    # from a write in progress is skipped.
+    for segment in (path + '.1', path):
+        try:
+            f = open(segment, 'rb')
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    yield line.decode('utf-8', 'replace')
+
+@contextmanager
+def file_lock(path):
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def file_migrate_legacy():
+    try:
+        os.rename(EVENTS_FILE, EVENTS_FILE + '.migrating')
+    except FileNotFoundError:
+        return
+    try:
+        with open(EVENTS_FILE + '.migrating', 'r') as f:
+            legacy = json.loads(f.read())
+    except json.JSONDecodeError:
+        legacy = []
+    for events in group_by_partition(legacy).values():
+        path = file_partition_path(events[0].get('store', ''), utc_day(events[0]['server_time']))
+        file_append_lines(path, [json.dumps(e) for e in events])
+    os.remove(EVENTS_FILE + '.migrating')
+
+def file_archive_path(store_dir, day):
+    return os.path.join(ARCHIVE_DIR, store_dir, day + '.ndjson.gz')
+
+def file_iter_archive(path):
+    try:
+        f = gzip.open(path, 'rt')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            if line.strip():
+                yield line
+
+def file_list(path):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+def file_iter_events(store=None, start=None, end=None, cursor=None):
+    file_migrate_legacy()
+    if store:
+        stores = [safe_name(store)]
+    else:
+        stores = sorted(set(file_list(EVENTS_DIR)) | set(file_list(ARCHIVE_DIR)))
+    partitions = {}
+    for s in stores:
+        hot = {name[:-6] for name in file_list(os.path.join(EVENTS_DIR, s)) if name.endswith('.jsonl')}
+        archived = {name[:-10] for name in file_list(os.path.join(ARCHIVE_DIR, s)) if name.endswith('.ndjson.gz')}
+        for day in partition_days(hot | archived, start, end):
+            path = os.path.join(EVENTS_DIR, s, day + '.jsonl')
+            partitions.setdefault(day, []).append(
+                chain(file_iter_archive(file_archive_path(s, day)), file_iter_partition(path)))
+    items = merge_partitions(partitions, start, end, cursor)
+    if store and safe_name(store) != store:
+        # Another store may share the sanitised directory name
+        items = (item for item in items if decode_item(item).get('store') == store)
+    return items
+
+def file_compact(hot_days):
+    cutoff = compaction_cutoff(hot_days)
+    stats = {'partitions': 0, 'events': 0}
+    for s in file_list(EVENTS_DIR):
+        for name in file_list(os.path.join(EVENTS_DIR, s)):
+            if not name.endswith('.jsonl') or name[:-6] >= cutoff:
+                continue
+            path = os.path.join(EVENTS_DIR, s, name)
+            items = list(file_iter_partition(path))
+            if items:
+                archive = file_archive_path(s, name[:-6])
+                os.makedirs(os.path.dirname(archive), exist_ok=True)
+                # Each run appends one gzip member; readers see one stream
+                with open(archive, 'ab') as f:
+                    f.write(gzip.compress(''.join(items).encode()))
+            for segment in (path + '.1', path):
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass
+            _segment_lines.pop(path, None)
+            stats['partitions'] += 1
+            stats['events'] += len(items)
+    return stats
+
+# Rollups are split by how they grow. ROLLUPS_FILE holds the small per-day
+# hashes; unique sessions go to one UNIQUES_DIR file per day, so a batch only
+# loads the days it touches; guided counters live in GUIDED_FILE and are
+# dropped once they expire; the write version is its own file so a GET can
+# check it without parsing anything. All of them are written under the
+# ROLLUPS_FILE lock.
+def file_write_events(events):
+    with file_lock(ROLLUPS_FILE + '.lock'):
+        # Read rollups first so a first-time backfill can't count this batch twice
+        rollups = file_locked_rollups()
+        uniques = {}
+        guided_counts = file_read_guided()
+        sampled = [raw for raw in map(sample_event, events) if raw is not None]
+        for batch in group_by_partition(sampled).values():
+            path = file_partition_path(batch[0].get('store', ''), utc_day(batch[0]['server_time']))
+            file_append_lines(path, [encode_event(e) for e in batch])
+        for event in events:
+            file_apply(rollups, rollup_commands(event), uniques)
+            file_apply(rollups, promo_commands(event))
+            file_apply(rollups, answer_commands(event))
+            guided = guided_commands(event)
+            if guided:
+                count = file_apply(rollups, guided, counters=guided_counts)[0]
+                file_apply(rollups, consultation_commands(event, count))
+        file_save_rollups(rollups)
+        for day, stores in uniques.items():
+            file_save_uniques(day, stores)
+        file_save_guided(guided_counts)
+        file_save_json(VERSION_FILE, file_read_version() + 1)
+
+def file_load_json(path, default):
     try:
-        with open(EVENTS_FILE, 'r') as f:
+        with open(path, 'r') as f:
             return json.loads(f.read())
     except (FileNotFoundError, json.JSONDecodeError):
-        return []
+        return default
+
+def file_save_json(path, value):
+    # Write-then-rename so readers never see a half-written file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(value))
+    os.replace(tmp, path)
+
+def file_read_rollups():
+    rollups = file_load_json(ROLLUPS_FILE, None)
+    if rollups is None:
+        with file_lock(ROLLUPS_FILE + '.lock'):
+            rollups = file_locked_rollups()
+    return rollups
+
+def file_locked_rollups():
+    """Rollups for a caller holding the lock, backfilled on first use."""
+    rollups = file_load_json(ROLLUPS_FILE, None)
+    if rollups is not None:
+        return rollups
+    # First rollup file on this instance: fold in whatever is already stored
+    rollups, uniques = {}, {}
+    events = decode_events(file_iter_events())
+    file_apply(rollups, backfill_rollups(events, None), uniques)
+    file_apply(rollups, backfill_promos(events, None))
+    file_apply(rollups, backfill_answers(events, None))
+    rollups['promo:backfilled'] = 1
+    rollups['answers:backfilled'] = 1
+    for day, stores in uniques.items():
+        file_save_uniques(day, stores)
+    file_save_rollups(rollups)
+    return rollups
+
+def file_save_rollups(rollups):
+    file_save_json(ROLLUPS_FILE, rollups)
+
+def file_uniques_path(day):
+    return os.path.join(UNIQUES_DIR, safe_name(day) + '.json')
+
+def file_read_uniques(day):
+    """store -> set of session IDs seen on that day."""
+    return {store: set(members) for store, members in file_load_json(file_uniques_path(day), {}).items()}
+
+def file_save_uniques(day, stores):
+    os.makedirs(UNIQUES_DIR, exist_ok=True)
+    file_save_json(file_uniques_path(day), {store: sorted(members) for store, members in stores.items()})
+
+def file_read_guided():
+    return file_load_json(GUIDED_FILE, {})
+
+def file_save_guided(counters):
+    now = time.time()
+    file_save_json(GUIDED_FILE, {key: entry for key, entry in counters.items() if entry[1] is None or entry[1] > now})
 
-def file_write_event(event):
-    events = file_read_events()
-    events.append(event)
-    if len(events) > 10000:
-        events = events[-10000:]
-    with open(EVENTS_FILE, 'w') as f:
-        f.write(json.dumps(events))
+def file_read_version():
+    return int(file_load_json(VERSION_FILE, 0) or 0)
+
+def file_apply(rollups, commands, uniques=None, counters=None):
+    """Apply the subset of Redis commands used by rollups to plain dicts.
+
+    PFADDs go to 'uniques' (day -> store -> set, loaded on first use) and
+    INCR/EXPIRE to 'counters' (key -> [count, expires or None]).
+    """
+    results = []
+    for command in commands:
+        op, key = command[0], command[1]
+        if op in ('HINCRBY', 'HINCRBYFLOAT'):
+            h = rollups.setdefault(key, {})
+            h[command[2]] = h.get(command[2], 0) + command[3]
+            results.append(h[command[2]])
+        elif op == 'PFADD':
+            # The file backend keeps uniques exactly; it only sees one instance
+            store, day = key.split(':', 1)[1].rsplit(':', 1)
+            if day not in uniques:
+                uniques[day] = file_read_uniques(day)
+            uniques[day].setdefault(store, set()).add(command[2])
+            results.append(1)
+        elif op == 'SADD':
+            members = rollups.setdefault(key, [])
+            if command[2] not in members:
+                members.append(command[2])
+            results.append(1)
+        elif op == 'SET':
+            if 'NX' not in command[3:] or key not in rollups:
+                rollups[key] = command[2]
+            results.append(True)
+        elif op == 'INCR':
+            entry = counters.get(key)
+            if not entry or (entry[1] is not None and entry[1] <= time.time()):
+                entry = counters[key] = [0, None]
+            entry[0] += 1
+            results.append(entry[0])
+        elif op == 'EXPIRE':
+            counters[key][1] = time.time() + command[2]
+            results.append(1)
+        else:
+            results.append(None)
+    return results
+
+def file_read_rollups_range(store, range_name, key=rollup_key):
+    rollups = file_read_rollups()
+    days = range_days(range_name, rollups.get('agg:days', []))
+    return days, [rollups.get(key(store, day), {}) for day in days]
+
+def file_store_path(key):
+    return os.path.join(STORE_DIR, safe_name(key) + '.json')
+
+def file_store_get(key):
+    try:
+        with open(file_store_path(key), 'r') as f:
+            entry = json.loads(f.read())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if entry.get('expires', 0) < time.time():
+        return None
+    return entry.get('value')
+
+def file_store_set(key, value, ttl):
+    path = file_store_path(key)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(json.dumps({'expires': time.time() + ttl, 'value': value}))
+    os.replace(tmp, path)
+
+def file_count_uniques(store, days):
+    members = set()
+    for day in days:
+        members.update(file_read_uniques(day).get(store, ()))
+    return len(members)
+
+def file_ensure_cube(name, backfill):
+    with file_lock(ROLLUPS_FILE + '.lock'):
+        rollups = file_locked_rollups()
+        if rollups.get(f'{name}:backfilled'):
+            return
+        since = rollups.get(f'{name}:since')
+        file_apply(rollups, backfill(decode_events(file_iter_events()), float(since) if since else None))
+        rollups[f'{name}:backfilled'] = 1
+        file_save_rollups(rollups)
+
+def file_read_promos(store, range_name):
+    file_ensure_cube('promo', backfill_promos)
+    return file_read_rollups_range(store, range_name, promo_key)
+
+def file_read_answers(store, range_name):
+    file_ensure_cube('answers', backfill_answers)
+    return file_read_rollups_range(store, range_name, answer_key)
 
 # --- Dispatch helpers ---
-def write_event(event):
+def write_events(events):
+    if not events:
+        return
     st = get_storage_type()
     if st == 'redis':
-        redis_write_event(event)
+        redis_write_events(events)
     elif st == 'kv':
-        kv_write_event(event)
+        kv_write_events(events)
     else:
-        file_write_event(event)
+        file_write_events(events)
+
+def iter_events(store=None, start=None, end=None, since=None, cursor=None):
+    """Stored events in the window as raw JSON strings, oldest first.
 
-def read_events():
+    With 'since', only events after that cursor are returned. If a 'cursor'
+    dict is given, cursor['value'] tracks the cursor to resume from.
+    """
+    if cursor is not None:
+        cursor['value'] = since
     st = get_storage_type()
+    if st == 'redis' and REDIS_MODE == 'streams':
+        return redis_iter_stream_events(store, start, end, since, cursor)
+    if since:
+        resume = cursor_time(since) - CURSOR_OVERLAP
+        start = resume if start is None else max(start, resume)
     if st == 'redis':
-        return redis_read_events()
+        return redis_iter_events(store, start, end, cursor)
     elif st == 'kv':
-        return kv_read_events()
+        return kv_iter_events(store, start, end, cursor)
     else:
-        return file_read_events()
+        return file_iter_events(store, start, end, cursor)
+
+def read_events(store=None, start=None, end=None):
+    return decode_events(iter_events(store, start, end))
+
+def stored_days():
+    st = get_storage_type()
+    if st == 'redis':
+        return _redis_client.smembers('agg:days')
+    elif st == 'kv':
+        return kv_single(['SMEMBERS', 'agg:days']) or []
+    else:
+        return file_read_rollups().get('agg:days', [])
+
+def recent_events(limit, store=None, start=None, end=None, since=None, cursor=None):
+    """The newest 'limit' events in the window, oldest first, like iter_events.
+
+    Days are read newest first and reading stops once enough events are
+    found, so a short recent-activity list costs a day or two of reads
+    whatever the range.
+    """
+    picked = []
+    day_cursor = {}
+    if cursor is not None:
+        cursor['value'] = since
+    for day in sorted(partition_days(stored_days(), start, end), reverse=True):
+        lo, hi = parse_time(day), parse_time(day, end=True)
+        lo = lo if start is None else max(lo, start)
+        hi = hi if end is None else min(hi, end)
+        items = list(iter_events(store, lo, hi, since, day_cursor))
+        if items and not picked and cursor is not None:
+            cursor['value'] = day_cursor['value']
+        picked[:0] = items
+        if len(picked) >= limit:
+            break
+    return iter(picked[-limit:])
 
 def read_counters():
     st = get_storage_type()
@@ -177,13 +1333,348 @@ def read_counters():
     else:
         return None
 
+# Small string values with a TTL (chat sessions, cached replies) kept on
+# whichever backend holds the events, for the other endpoints to share.
+def store_get(key):
+    st = get_storage_type()
+    if st == 'redis':
+        return redis_store_get(key)
+    elif st == 'kv':
+        return kv_store_get(key)
+    else:
+        return file_store_get(key)
+
+def store_set(key, value, ttl):
+    st = get_storage_type()
+    if st == 'redis':
+        redis_store_set(key, value, ttl)
+    elif st == 'kv':
+        kv_store_set(key, value, ttl)
+    else:
+        file_store_set(key, value, ttl)
+
+def read_version():
+    st = get_storage_type()
+    if st == 'redis':
+        version = redis_read_version()
+    elif st == 'kv':
+        version = kv_read_version()
+    else:
+        version = file_read_version()
+    return int(version or 0)
+
+def wait_for_writes(version, timeout, poll=None):
+    """Block until the write version moves past 'version' or 'timeout' passes.
+
+    On KV the poll interval doubles while nothing changes, up to
+    KV_LIVE_POLL_MAX. If a 'poll' dict is given, poll['delay'] carries the
+    interval across calls.
+    """
+    poll = {} if poll is None else poll
+    st = get_storage_type()
+    deadline = time.time() + timeout
+    while True:
+        current = read_version()
+        remaining = deadline - time.time()
+        if current != version:
+            poll['delay'] = LIVE_POLL
+            return current
+        if remaining <= 0:
+            return current
+        if st == 'redis' and REDIS_MODE == 'streams':
+            redis_wait_stream(remaining)
+        else:
+            delay = poll.get('delay', LIVE_POLL)
+            time.sleep(min(delay, remaining))
+            if st == 'kv':
+                poll['delay'] = min(delay * 2, KV_LIVE_POLL_MAX)
+
+def etag(version):
+    # Weak: queue stats and debug fields may differ between equal versions.
+    # The UTC day is included because relative summary ranges roll over.
+    return 'W/"%d-%s"' % (version, datetime.now(timezone.utc).date().isoformat())
+
+def compact_events(hot_days=HOT_DAYS):
+    st = get_storage_type()
+    if st == 'redis':
+        stats = redis_compact(hot_days)
+    elif st == 'kv':
+        stats = kv_compact(hot_days)
+    else:
+        stats = file_compact(hot_days)
+    stats['cutoff'] = compaction_cutoff(hot_days)
+    return stats
+
+# --- Write-behind queue ---
+# POSTs enqueue events and answer immediately; a background thread
+# coalesces whatever is pending into one write_events() batch. The queue
+# is bounded: overflow and batches the backend rejects are spilled to a
+# local JSONL file and replayed after the next successful flush, and
+# anything that cannot be spilled is dropped and counted.
+#
+# A batch is stamped with its flush time, so time cursors (which re-read
+# only CURSOR_OVERLAP seconds) still see events that waited in the queue.
+# Replayed spills keep the time they were received, so they land on the
+# right day in rollups and full reads, but incremental since= readers and
+# the live feed that have already moved past that time don't see them.
+WRITE_BEHIND = os.environ.get('ANALYTICS_WRITE_BEHIND', '1') != '0'
+WRITE_QUEUE_MAX = int(os.environ.get('ANALYTICS_QUEUE_MAX', '5000'))
+WRITE_FLUSH_MAX = 1000
+WRITE_DRAIN_TIMEOUT = 8.0
+
+class WriteBehindQueue:
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.flushing = 0
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stats = {'queued': 0, 'written': 0, 'spilled': 0, 'replayed': 0, 'dropped': 0, 'failed_flushes': 0}
+
+    def submit(self, events):
+        with self.cond:
+            room = max(self.max_pending - len(self.pending), 0)
+            accepted, overflow = events[:room], events[room:]
+            self.pending.extend(accepted)
+            self.stats['queued'] += len(accepted)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='analytics-flusher', daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+        if overflow:
+            self._spill(overflow)
+
+    def drain(self, timeout=WRITE_DRAIN_TIMEOUT):
+        """Block until everything queued so far is stored (or the timeout passes)."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.pending or self.flushing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                batch = [self.pending.popleft() for _ in range(min(len(self.pending), WRITE_FLUSH_MAX))]
+                self.flushing += 1
+            server_time = round(time.time(), 3)
+            for event in batch:
+                event['server_time'] = server_time
+            try:
+                write_events(batch)
+                self.stats['written'] += len(batch)
+            except Exception as e:
+                print(f"Analytics flush failed ({len(batch)} events): {str(e)}")
+                self.stats['failed_flushes'] += 1
+                self._spill(batch)
+            else:
+                # Separate from the write above: the batch is already stored
+                try:
+                    self._replay()
+                except Exception as e:
+                    print(f"Analytics spill replay failed: {str(e)}")
+            finally:
+                with self.cond:
+                    self.flushing -= 1
+                    self.cond.notify_all()
+
+    def _spill(self, events):
+        try:
+            with file_lock(SPILL_FILE + '.lock'):
+                with open(SPILL_FILE, 'a') as f:
+                    f.write(''.join(json.dumps(e) + '\n' for e in events))
+            self.stats['spilled'] += len(events)
+        except OSError as e:
+            print(f"Analytics spill failed, dropping {len(events)} events: {str(e)}")
+            self.stats['dropped'] += len(events)
+
+    def _replay(self):
+        # A replay that failed part way leaves its file behind; finish it first
+        if not os.path.exists(SPILL_FILE + '.replaying'):
+            if not os.path.exists(SPILL_FILE):
+                return
+            with file_lock(SPILL_FILE + '.lock'):
+                try:
+                    os.rename(SPILL_FILE, SPILL_FILE + '.replaying')
+                except FileNotFoundError:
+                    return
+        with open(SPILL_FILE + '.replaying', 'r') as f:
+            spilled = decode_events(f)
+        for i in range(0, len(spilled), WRITE_FLUSH_MAX):
+            try:
+                write_events(spilled[i:i + WRITE_FLUSH_MAX])
+                self.stats['replayed'] += len(spilled[i:i + WRITE_FLUSH_MAX])
+            except Exception:
+                self._spill(spilled[i:])
+                break
+        os.remove(SPILL_FILE + '.replaying')
+
+_write_queue = WriteBehindQueue(WRITE_QUEUE_MAX)
+
+def read_summary(store, range_name):
+    st = get_storage_type()
+    store = store if store and store != 'all' else ALL_STORES
+    if st == 'redis':
+        days, hashes = redis_read_rollups(store, range_name)
+        uniques = redis_count_uniques(store, days)
+    elif st == 'kv':
+        days, hashes = kv_read_rollups(store, range_name)
+        uniques = kv_count_uniques(store, days)
+    else:
+        days, hashes = file_read_rollups_range(store, range_name)
+        uniques = file_count_uniques(store, days)
+    summary = merge_rollups(hashes)
+    summary['unique_sessions'] = uniques
+    summary['from'] = days[0] if days else None
+    summary['to'] = days[-1] if days else None
+    return summary
+
+def read_promos(store, range_name):
+    st = get_storage_type()
+    store = store if store and store != 'all' else ALL_STORES
+    if st == 'redis':
+        days, hashes = redis_read_promos(store, range_name)
+    elif st == 'kv':
+        days, hashes = kv_read_promos(store, range_name)
+    else:
+        days, hashes = file_read_promos(store, range_name)
+    return {
+        'promos': merge_promos(hashes),
+        'from': days[0] if days else None,
+        'to': days[-1] if days else None,
+    }
+
+def read_answers(store, range_name):
+    st = get_storage_type()
+    store = store if store and store != 'all' else ALL_STORES
+    if st == 'redis':
+        days, hashes = redis_read_answers(store, range_name)
+    elif st == 'kv':
+        days, hashes = kv_read_answers(store, range_name)
+    else:
+        days, hashes = file_read_answers(store, range_name)
+    return {
+        'answers': merge_answers(hashes),
+        'from': days[0] if days else None,
+        'to': days[-1] if days else None,
+    }
+
+# --- Live feed ---
+# GET /analytics/stream is a Server-Sent Events feed bounded to LIVE_SECONDS
+# so it fits the function timeout; EventSource reconnects on its own and
+# resumes from the Last-Event-ID cursor. Between pushes the handler waits
+# on the write version (an XREAD BLOCK in streams mode, a cheap poll
+# otherwise) and only then reads events after its cursor. KV bills every
+# command, so its poll backs off while the store is quiet.
+LIVE_SECONDS = float(os.environ.get('ANALYTICS_LIVE_SECONDS', '25'))
+LIVE_POLL = 2.0
+KV_LIVE_POLL_MAX = 15.0
+LIVE_KEEPALIVE = 10.0
+LIVE_RETRY_MS = 1000
+
+def sse_message(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id else []
+    lines += [f'event: {event}', f'data: {data}']
+    return '\n'.join(lines) + '\n\n'
+
+# --- Export ---
+# GET /analytics/export streams the stored events as NDJSON or CSV straight
+# from the paged backend iterators, so memory stays flat however large the
+# range. CSV flattens the event_data keys the app sends into fixed columns;
+# anything else lands in event_data_extra as JSON.
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+EXPORT_FIELDS = ['server_time', 'timestamp', 'store', 'sessionId', 'client', 'event_type', 'sample_weight']
+EXPORT_DATA_FIELDS = ['sku', 'flow', 'name', 'email', 'question', 'answer',
+                      'product', 'brand', 'price', 'source', 'viewDuration', 'role']
+
+def export_header():
+    return EXPORT_FIELDS + ['data_' + key for key in EXPORT_DATA_FIELDS] + ['event_data_extra']
+
+def export_row(event):
+    data = event.get('event_data') if isinstance(event.get('event_data'), dict) else {}
+    extra = {k: v for k, v in data.items() if k not in EXPORT_DATA_FIELDS}
+    server_time = event.get('server_time')
+    row = [
+        iso_ms(round(server_time * 1000)) if isinstance(server_time, (int, float)) else '',
+        event.get('timestamp', ''),
+        event.get('store', ''),
+        event.get('sessionId', ''),
+        event.get('client', ''),
+        event.get('event_type', ''),
+        event.get('sample_weight', 1),
+    ]
+    row += [data.get(key, '') for key in EXPORT_DATA_FIELDS]
+    row.append(json.dumps(extra) if extra else '')
+    return row
+
+def export_lines(items, fmt):
+    """Stored event strings -> export lines in the requested format."""
+    if fmt == 'ndjson':
+        for item in items:
+            yield json_item(item) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_header())
+    # The header goes out even when the range is empty
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for item in items:
+        try:
+            writer.writerow(export_row(decode_item(item)))
+        except (json.JSONDecodeError, TypeError, ValueError, IndexError):
+            continue
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+# --- Streaming responses ---
+class StreamWriter:
+    """Buffers small writes into ~64 KB body chunks (chunked-encoded when asked)."""
+    def __init__(self, wfile, chunked=True, size=65536):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.size = size
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer).encode()
+        self.buffer = []
+        self.buffered = 0
+        if self.chunked:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+        self.wfile.flush()
+
+    def close(self):
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
 # --- Handler ---
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
         self.end_headers()
 
     def do_POST(self):
@@ -192,23 +1683,39 @@ class handler(BaseHTTPRequestHandler):
             post_data = self.rfile.read(content_length)
             data = json.loads(post_data)
 
-            event = {
-                'sessionId': data.get('sessionId', ''),
-                'store': data.get('store', 'leroy-merlin'),
-                'event_type': data.get('event_type', ''),
-                'event_data': data.get('event_data', {}),
-                'client': data.get('client', 'direct'),
-                'timestamp': data.get('timestamp', ''),
-                'server_time': time.time()
-            }
+            # A single event object, a JSON array, or {"events": [...]}
+            if isinstance(data, dict) and isinstance(data.get('events'), list):
+                data = data['events']
+            items = data if isinstance(data, list) else [data]
+            if len(items) > MAX_BATCH:
+                raise ValueError(f'Batch too large (max {MAX_BATCH} events)')
+
+            # Millisecond precision, as the compact encoding stores it
+            server_time = round(time.time(), 3)
+            events = [{
+                'sessionId': item.get('sessionId', ''),
+                'store': item.get('store', 'leroy-merlin'),
+                'event_type': item.get('event_type', ''),
+                'event_data': item.get('event_data', {}),
+                'client': item.get('client', 'direct'),
+                'timestamp': item.get('timestamp', ''),
+                'server_time': server_time
+            } for item in items if isinstance(item, dict)]
 
-            write_event(event)
+            if not WRITE_BEHIND:
+                write_events(events)
+            elif events:
+                _write_queue.submit(events)
 
+            body = json.dumps({'ok': True, 'accepted': len(events), 'storage': get_storage_type()}).encode()
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Connection', 'close')
             self.end_headers()
-            self.wfile.write(json.dumps({'ok': True, 'storage': get_storage_type()}).encode())
+            self.wfile.write(body)
+            self.wfile.flush()
 
         except Exception as e:
             self.send_response(400)
@@ -216,20 +1723,84 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             self.wfile.write(json.dumps({'error': str(e)}).encode())
+            return
+
+        if WRITE_BEHIND:
+            # The client already has its response; finish storing before the
+            # platform is free to freeze this invocation.
+            _write_queue.drain()
+
+    def _send_json(self, status, payload, tag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if tag:
+            self._send_etag(tag)
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
 
     def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        view = query.get('view', [''])[0]
+        if view == 'summary':
+            self._get_summary(query)
+            return
+        if view == 'promos':
+            self._get_promos(query)
+            return
+        if view == 'answers':
+            self._get_answers(query)
+            return
+        if view == 'stream':
+            self._live(query)
+            return
+        if view == 'export':
+            self._export(query)
+            return
+        if query.get('action', [''])[0] == 'compact':
+            self._compact(query)
+            return
         try:
-            events = read_events()
+            store = query.get('store', ['all'])[0]
+            store = None if store == 'all' else store
+            start = parse_time(query.get('from', [''])[0])
+            end = parse_time(query.get('to', [''])[0], end=True)
+            since = query.get('since', [''])[0] or None
+            if since:
+                cursor_time(since)  # reject malformed cursors before streaming
+            limit = int(query.get('limit', ['0'])[0] or 0)
+            compact = query.get('encoding', [''])[0] == 'compact'
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            tag = etag(read_version())
+            if self._not_modified(tag):
+                return
+            cursor = {}
+            if limit > 0:
+                items = recent_events(limit, store, start, end, since, cursor)
+            else:
+                items = iter_events(store, start, end, since, cursor)
             counters = read_counters()
             storage = get_storage_type()
 
             response = {
-                'events': events,
-                'count': len(events),
                 'storage': storage,
+                'store': store or 'all',
+                'from': start,
+                'to': end,
+                'since': since,
             }
+            if limit > 0:
+                response['limit'] = limit
+            if compact:
+                response['event_codes'] = EVENT_CODES
             if counters:
                 response['counters'] = counters
+            if WRITE_BEHIND:
+                response['write_behind'] = dict(_write_queue.stats, pending=len(_write_queue.pending))
 
             # Debug info when not using Redis
             if storage == 'file':
@@ -239,16 +1810,215 @@ class handler(BaseHTTPRequestHandler):
                     'KV_REST_API_URL_set': bool(KV_REST_API_URL),
                     'KV_REST_API_TOKEN_set': bool(KV_REST_API_TOKEN),
                 }
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
 
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
+        self._stream_events(response, items, cursor, tag, compact)
 
+    def _not_modified(self, tag):
+        if self.headers.get('If-None-Match') != tag:
+            return False
+        self.send_response(304)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self._send_etag(tag)
+        self.end_headers()
+        return True
+
+    def _stream_events(self, response, items, cursor, tag, compact=False):
+        """Write the stored event strings straight into the response body."""
+        out = self._start_stream('application/json', tag)
+        head = json.dumps(response)
+        out.write(head[:-1] + ', "events": [')
+        tail = {'count': 0}
+        try:
+            for item in items:
+                if not compact:
+                    item = json_item(item)
+                out.write(item if tail['count'] == 0 else ',' + item)
+                tail['count'] += 1
         except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': str(e)}).encode())
+            # Headers are already sent; close the array and report in-band
+            print(f"Analytics stream error after {tail['count']} events: {str(e)}")
+            tail['error'] = str(e)
+        tail['cursor'] = cursor.get('value')
+        out.write('], ' + json.dumps(tail)[1:])
+        out.close()
+
+    def _live(self, query):
+        try:
+            store = query.get('store', ['all'])[0]
+            store = None if store == 'all' else store
+            # A reconnecting EventSource resumes from the last id it saw
+            since = self.headers.get('Last-Event-ID') or query.get('since', [''])[0]
+            since = since or repr(round(time.time(), 3))
+            cursor_time(since)
+            compact = query.get('encoding', [''])[0] == 'compact'
+            version = read_version()
+        except Exception as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        out = self._start_stream('text/event-stream')
+        out.write(f'retry: {LIVE_RETRY_MS}\n')
+        out.write(sse_message('ready', json.dumps({'cursor': since}), since))
+        out.flush()
+        deadline = time.time() + LIVE_SECONDS
+        sent = set()
+        poll = {}
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                current = wait_for_writes(version, min(remaining, LIVE_KEEPALIVE), poll)
+                if current == version:
+                    out.write(': keepalive\n\n')
+                    out.flush()
+                    continue
+                version = current
+                cursor = {}
+                # The time cursor's overlap re-reads a few events; skip those
+                items = [item for item in iter_events(store, since=since, cursor=cursor) if item not in sent]
+                since = cursor.get('value') or since
+                if not items:
+                    continue
+                sent.update(items)
+                tail = {'counters': read_counters(), 'cursor': since}
+                if compact:
+                    tail['event_codes'] = EVENT_CODES
+                data = '{"events": [' + ','.join(items if compact else map(json_item, items)) + '], ' + json.dumps(tail)[1:]
+                out.write(sse_message('events', data, since))
+                out.flush()
+        except Exception as e:
+            print(f"Analytics live feed error: {str(e)}")
+            out.write(sse_message('error', json.dumps({'error': str(e)})))
+        out.close()
+
+    def _export(self, query):
+        try:
+            fmt = query.get('format', ['csv'])[0]
+            if fmt not in EXPORT_FORMATS:
+                raise ValueError(f'Unknown export format: {fmt}')
+            store = query.get('store', ['all'])[0]
+            start = parse_time(query.get('from', [''])[0])
+            end = parse_time(query.get('to', [''])[0], end=True)
+            items = iter_events(None if store == 'all' else store, start, end)
+        except Exception as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        days = [utc_day(ts) if ts is not None else '' for ts in (start, end)]
+        filename = '-'.join(['grannybqr-analytics', safe_name(store)] + [d for d in days if d]) + '.' + fmt
+        out = self._start_stream(EXPORT_FORMATS[fmt], filename=filename)
+        try:
+            for line in export_lines(items, fmt):
+                out.write(line)
+        except Exception as e:
+            # Headers are already sent; the truncated file ends with the error
+            print(f"Analytics export error: {str(e)}")
+            out.write(('# error: %s\n' if fmt == 'csv' else '{"error": %s}\n') % json.dumps(str(e)))
+        out.close()
+
+    def _start_stream(self, content_type, tag=None, filename=None):
+        # Chunked framing needs HTTP/1.1; an HTTP/1.0 body is delimited by close
+        chunked = self.request_version != 'HTTP/1.0'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if tag:
+            self._send_etag(tag)
+        else:
+            self.send_header('Cache-Control', 'no-cache')
+        if filename:
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Connection', 'close')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return StreamWriter(self.wfile, chunked)
+
+    def _compact(self, query):
+        # Run daily by the Vercel cron in vercel.json, which sends CRON_SECRET
+        secret = os.environ.get('CRON_SECRET')
+        if not secret:
+            self._send_json(503, {'error': 'CRON_SECRET is not set'})
+            return
+        if self.headers.get('Authorization') != 'Bearer ' + secret:
+            self._send_json(401, {'error': 'Unauthorized'})
+            return
+        try:
+            hot_days = int(query.get('days', [HOT_DAYS])[0])
+        except ValueError:
+            hot_days = 0
+        if hot_days < 1:
+            self._send_json(400, {'error': 'days must be a whole number of at least 1'})
+            return
+        try:
+            stats = compact_events(hot_days)
+            stats['storage'] = get_storage_type()
+            self._send_json(200, stats)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+
+    def _send_etag(self, tag):
+        # no-cache: browsers keep the body but revalidate on every refresh
+        self.send_header('ETag', tag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+
+    def _get_promos(self, query):
+        try:
+            tag = etag(read_version())
+            if self._not_modified(tag):
+                return
+            store = query.get('store', ['all'])[0]
+            range_name = query.get('range', ['7days'])[0]
+            promos = read_promos(store, range_name)
+            promos.update({
+                'view': 'promos',
+                'store': store,
+                'range': range_name,
+                'storage': get_storage_type(),
+            })
+            self._send_json(200, promos, tag)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+
+    def _get_answers(self, query):
+        try:
+            tag = etag(read_version())
+            if self._not_modified(tag):
+                return
+            store = query.get('store', ['all'])[0]
+            range_name = query.get('range', ['7days'])[0]
+            answers = read_answers(store, range_name)
+            answers.update({
+                'view': 'answers',
+                'store': store,
+                'range': range_name,
+                'storage': get_storage_type(),
+            })
+            self._send_json(200, answers, tag)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+
+    def _get_summary(self, query):
+        try:
+            tag = etag(read_version())
+            if self._not_modified(tag):
+                return
+            store = query.get('store', ['all'])[0]
+            range_name = query.get('range', ['7days'])[0]
+            summary = read_summary(store, range_name)
+            summary.update({
+                'view': 'summary',
+                'store': store,
+                'range': range_name,
+                'storage': get_storage_type(),
+            })
+            self._send_json(200, summary, tag)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
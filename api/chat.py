@@ -1,66 +1,35 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import urllib.request
+import urllib.error
 import os
-
-class handler(BaseHTTPRequestHandler):
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        return
-
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        data = json.loads(post_data)
-
-        api_key = os.environ.get('ANTHROPIC_API_KEY')
-
-        if not api_key:
-            self.send_error(500, "API key not configured")
-            return
-
-        url = "https://api.anthropic.com/v1/messages"
-
-        language = data.get('language', 'en')
-        sku = data.get('sku', '81415711')
-        store = data.get('store', 'leroy-merlin')
-        flow = data.get('flow', 'product')
-
-        language_configs = {
-            'en': {
-                'name': 'English',
-                'instruction': 'Respond in English.',
-                'greeting': 'Hello'
-            },
-            'af': {
-                'name': 'Afrikaans',
-                'instruction': 'Jy is ons Verfadviseur. Antwoord ALTYD in Afrikaans. Hou antwoorde kort (2-3 sinne). Warm, vriendelike toon. Gebruik korrekte Afrikaanse grammatika en spelling. BELANGRIK: Moet NOOIT die handelsmerk by naam noem nie. Verwys eerder na "ons verf", "ons krytverf", "hierdie verf", of "ons produkte" in plaas van enige handelsmerk naam.',
-                'greeting': 'Goeie dag'
-            }
-        }
-
-        lang_config = language_configs.get(language, language_configs['en'])
-
-        product_intro = """You are Granny B's Paint Advisor, a friendly and knowledgeable assistant helping customers at Leroy Merlin choose the right Granny B's Old Fashioned Paint products.
-
-PRODUCT KNOWLEDGE:
-- The customer scanned: Chalk Paint Granny B's Daisy 1L (SKU 81415711, R259)
-- Daisy is a warm sunny yellow with a smooth velvety matt chalk finish
-- Chalkpaint (Old Fashioned Paint): 65+ colours, no sanding or prepping needed, eco-friendly, low-odour, lead-free, food-safe, kid-safe
-- Works on: glass, metal, wood, ceramic, enamel, melamine, fabric
-- Drying: touch-dry 30 mins, recoat 1-2 hours, full cure 21 days
-- Coverage: 1L covers approx 12-14 square metres
-- Companion products: Armour Sealer (water-based polyurethane for kitchens), Clear Wax, Dark Wax, Liquid Metal, Metallic Chalk Paint, Polka.Paint, stencils, decoupage tissue, brushes
-- Sizes: 125ml from R79.90, 500ml, 1L
-- Also available at grannyb.co.za with free delivery over R650
-- Payment options: PayJustNow (3 instalments), HappyPay (2 paydays)
-- Rewards programme at grannyb.co.za/pages/rewards"""
-
-        consultation_intro = """You are Granny B's Paint Advisor, a friendly and knowledgeable consultant helping customers at Leroy Merlin find the perfect Granny B's Old Fashioned Paint products for their project.
+import re
+
+from _faq import answer as faq_answer
+from _knowledge import (FACTS, SURFACE_TITLES, colour_text, product_text, range_text, relevant_surfaces,
+                        sealer_text, store_product_text, surface_text)
+from _replies import cache_key, get_reply, put_reply
+from _routing import PRIMARY_MODEL, open_reply
+from _sessions import in_sync, load_session, new_session, new_token, save_session, valid_token
+
+LANGUAGE_CONFIGS = {
+    'en': {
+        'name': 'English',
+        'instruction': 'Respond in English.',
+        'greeting': 'Hello'
+    },
+    'af': {
+        'name': 'Afrikaans',
+        'instruction': 'Jy is ons Verfadviseur. Antwoord ALTYD in Afrikaans. Hou antwoorde kort (2-3 sinne). Warm, vriendelike toon. Gebruik korrekte Afrikaanse grammatika en spelling. BELANGRIK: Moet NOOIT die handelsmerk by naam noem nie. Verwys eerder na "ons verf", "ons krytverf", "hierdie verf", of "ons produkte" in plaas van enige handelsmerk naam.',
+        'greeting': 'Goeie dag'
+    }
+}
+
+PRODUCT_INTRO = f"""You are Granny B's Paint Advisor, a friendly and knowledgeable assistant helping customers at Leroy Merlin choose the right Granny B's Old Fashioned Paint products.
+
+PRODUCT KNOWLEDGE (the scanned product is given below):
+{range_text()}"""
+
+CONSULTATION_INTRO = f"""You are Granny B's Paint Advisor, a friendly and knowledgeable consultant helping customers at Leroy Merlin find the perfect Granny B's Old Fashioned Paint products for their project.
 
 This is a FULL CONSULTATION. The customer has not scanned a specific product. You are helping them discover the right products from the entire Granny B's range.
 
@@ -74,71 +43,34 @@ CONSULTATION FLOW:
   "Beautiful choice! I know exactly what will work."
 - Once you have enough information (project type, specific piece, surface, desired look, AND experience level), deliver a COMPLETE PERSONALISED RECOMMENDATION including:
   1. Recommended Granny B's chalk paint colour(s) matched to their project and aesthetic
-  2. Right tin size (125ml sample jar R79.90 to try, or 1L from R259 for full project)
+  2. Right tin size ({FACTS['sample_size']} sample jar {FACTS['sample_price']} to try, or 1L from {FACTS['litre_price']} for full project)
   3. Step-by-step surface prep matched to their surface type (from Surface Prep Guide)
   4. Correct sealer recommendation (Armour for kitchens/bathrooms/high-traffic, Wax for vintage/decorative, Classic Seal for general)
   5. Relevant complementary Leroy Merlin products with aisle numbers
   6. Adjust advice complexity to experience level (beginner = detailed step-by-step, pro = shortcuts and advanced tips)
 
 GRANNY B'S PRODUCT RANGE:
-- Chalkpaint (Old Fashioned Paint): 65+ colours, no sanding or prepping needed, eco-friendly, low-odour, lead-free, food-safe, kid-safe
-- Works on: glass, metal, wood, ceramic, enamel, melamine, fabric
-- Drying: touch-dry 30 mins, recoat 1-2 hours, full cure 21 days
-- Coverage: 1L covers approx 12-14 square metres
-- Sizes: 125ml from R79.90, 500ml, 1L from R259
-- Companion products: Armour Sealer, Classic Seal, Clear Wax, Dark Wax, Black Magic Waxing Cream, Pappa G's Chalkpaint Waxes, Liquid Metal, Metallic Chalk Paint, Polka.Paint, stencils, decoupage tissue, brushes
-- Also available at grannyb.co.za with free delivery over R650
-- Payment options: PayJustNow (3 instalments), HappyPay (2 paydays)
-- Rewards programme at grannyb.co.za/pages/rewards
+{range_text()}
 
 COLOUR RECOMMENDATIONS (suggest based on project and desired aesthetic):
-- Daisy (warm sunny yellow): statement pieces, cheerful kitchens
-- Hessian (warm neutral beige): farmhouse, neutral tones
-- Hurricane (dark grey): modern, bold, dramatic
-- Vanilla Cream (creamy white): classic, clean, goes with everything
-- Olive Charm (olive green): trendy, earthy, botanical vibes
-- Peppermint Twist (soft green): fresh, calming, bedrooms
-- Pretty Flamingo (coral pink): bold, fun, kids rooms and decor
-- Tropical Cocktail (bright teal): statement maker, eclectic
-- Mushroom (dirty white): sophisticated neutral, French country
-- Midnight Sky (deep navy): dramatic, elegant, feature walls
-- Classic White: clean crisp white for Scandi and minimalist looks
-- French Lavender (soft purple): romantic, bedrooms
-- Fired Brick (earthy red): rustic farmhouse
-Always suggest grabbing a 125ml sample jar (R79.90, same shelf) if they seem unsure about colour.
+{colour_text()}
+Always suggest grabbing a {FACTS['sample_size']} sample jar ({FACTS['sample_price']}, same shelf) if they seem unsure about colour.
 
 SEALER GUIDE:
-- Armour Sealer: For kitchens, bathrooms, high-traffic furniture, outdoor pieces, dining tables, countertops
-- Classic Seal: For general sealing (doors, cabinet frames, decorative pieces)
-- Clear Waxing Cream: Classic satin finish for decorative pieces
-- Dark Wax / Black Magic Waxing Cream: Vintage distressed effects
-- Pappa G's Chalkpaint Waxes: Authentic hand-painted finish
-- NB: Waxes are decorative not protective. Sealers cannot be applied over waxes
-- NB: Oil-based waxes NOT recommended for kitchens, baby/kids furniture, toys, food surfaces"""
-
-        shared_sections = """
+{sealer_text()}"""
+
+SHARED_SECTIONS = f"""
 COMPLEMENTARY PRODUCTS AT LEROY MERLIN (mention these naturally when relevant, include aisle location):
 Always present TWO options: Dexter (value) and a premium brand alternative. Let the shopper choose.
 
 DEXTER VALUE RANGE:
-- Dexter Paint Brush Set (3-pack): R89, Aisle 4. Great value starter brushes.
-- Dexter Sandpaper Assorted Pack: R59, Aisle 3. Good all-round grits for prep and distressing.
-- Dexter Masking Tape 48mm: R39, Aisle 5. Solid tape for clean edges and two-tone work.
-- Dexter Drop Sheet 4x5m: R35, Aisle 3. Budget floor protection.
-- Dexter Paint Roller Set: R69, Aisle 4. Good for smooth modern finishes.
-- Dexter Scraper Set: R49, Aisle 4. For removing old flaking paint or prepping rough surfaces.
+{store_product_text('value')}
 
 PREMIUM BRAND ALTERNATIVES:
-- Dulux Precision Brush Set (3-pack): R149, Aisle 4. Premium synthetic brushes for professional results.
-- 3M Sandpaper Assorted 10-pack: R79, Aisle 3. Premium grits for fine finishing.
-- 3M ScotchBlue Painter's Tape 48mm: R89, Aisle 5. Premium clean lines, 14-day clean removal.
-- Plascon Double Velvet Roller Sleeve 200mm: R59, Aisle 4. Premium smooth finish roller.
-- Dulux Prep & Clean Sugar Soap 1L: R49, Aisle 3. For surface preparation and cleaning.
+{store_product_text('premium')}
 
 GRANNY B'S PRODUCTS (always on same shelf):
-- Granny B's Armour Sealer 1L: R289, same shelf. ALWAYS recommend for kitchens, bathrooms, high-traffic furniture, outdoor pieces, or dining tables.
-- Granny B's Wax: R189, same shelf. Recommend for vintage distressed looks or decorative pieces that won't get heavy use.
-- Granny B's Colour Range: 65+ colours from R79.90 in 125ml jars, same shelf. Mention when user seems undecided on colour or wants to try before committing to 1L.
+{store_product_text('granny_b')}
 
 RULES FOR MENTIONING PRODUCTS:
 - Always present 2 options: Dexter (value) AND a premium brand (Dulux/3M/Plascon). E.g. "For brushes, grab the Dexter 3-pack (R89, Aisle 4) for great value, or the Dulux Precision set (R149, same aisle) if you want top-end brushes."
@@ -148,42 +80,12 @@ RULES FOR MENTIONING PRODUCTS:
 - Include the aisle number so the shopper can walk straight there.
 - Maximum 1 product pair (value + premium) per response. Don't oversell.
 
-SURFACE PREPARATION GUIDE BY SURFACE TYPE:
-
-VARNISHED, OILED, STAINED & NATURALLY DARK WOOD:
-Preparation: Scrub with abrasive cleaning pad and sugar soap, allow to dry. Or use solvent-based cleaner like lacquer thinners. Dark wood, stained, waxed and oiled surfaces may display yellow patches after painting/sealing, known as bleeding or wood-bleed. Avoid sanding away varnish unless flaking. To combat wood-bleed, use stain-blocking: Option 1 Armour (base coat, dry 1hr, 3 coats Armour 1hr apart, cure 72hrs). Option 2 Block & Tackle or Zinsser 123 primer, 2-3 coats.
-Paint: Apply 1st coat, 1-2hrs drying. Additional coats 1hr apart. Final coat dry overnight. Use silicone bristle brush or foam roller. Brush for classic look, sponge roller for contemporary smooth. Spraying: dilute max 30% with distilled water, allow extra drying time.
-Seal: 2-3 coats of sealer. Armour for hard-wearing surfaces (counter tops, work surfaces). Classic Seal for general sealing (doors, cabinet frames). 1-2hrs between coats. Clear Waxing Cream for classic satin finish. Can technique with Black Magic Waxing Cream. Restrict traffic for 72hrs. Pappa G's Chalkpaint Waxes for authentic hand-painted finish. Waxes are decorative not protective. Sealers cannot be applied over waxes.
-
-LAMINATE OR MELAMINE:
-Preparation: Scrub with abrasive pad and sugar soap, dry 2-3hrs. Or solvent-based cleaner. For glossy surfaces, de-gloss with light sanding. Priming optional with Granny B's.
-Paint: 1st coat, 3-4hrs drying. Additional coats 1-2hrs apart. Final coat dry overnight. Silicone bristle brush or foam roller. Brush for classic, foam roller for contemporary.
-Seal: 2-3 coats sealer. Armour for hard-wearing, Classic Seal for general. 1-2hrs between coats. Clear Waxing Cream for satin finish. Restrict traffic 72hrs. NB: Traditional oil-based waxes NOT recommended for kitchens, baby/kids furniture, toys, or food serving surfaces.
-
-GLASS (DECORATIVE):
-Preparation: Scrub with abrasive pad and sugar soap, dry thoroughly. Apply base layer, dry in sun 3-4hrs. Decorative: priming not required, sand lightly for adhesion. Functional (tiles): always de-gloss with light sanding. Smooth/glossy tiles: prime with purpose-specific tile primer.
-Paint: Base-coat, dry in sun 2-3hrs. Subsequent layers 1hr apart, brush in one direction. Final coat dry and seal. Expert Tip: Heat oven to 180 degrees, turn off, place painted item in oven, leave until cooled for extra strong bond.
-Seal: 2-3 coats sealer. 1-2hrs between coats. Pappa G's Waxes for authentic finish. Waxes decorative not protective. Sealers cannot go over waxes.
-
-WOODEN FLOORS:
-Preparation: Clean with sugar soap and scrubbing brush. Dry overnight, wipe down. Previously stained/oiled/varnished/dark wood may bleed into light colours. Test a section first. Stain-blocking same as dark wood options. Don't sand away varnish unless flaking.
-Paint: 1st coat, 1hr drying. Additional coats 1hr apart. Final coat dry 2hrs. Brush for classic textured, sponge roller for smooth. Spraying: dilute max 30% distilled water.
-Seal: 3-5 coats Armour depending on traffic. Maintenance coat every 12 months. Heavy-duty: use clear non-yellowing solvent-based floor sealer.
-
-BARE / CLEANED WOOD:
-Preparation: Scrub with abrasive pad and sugar soap. Dark wood tannin can bleed even after cleaning. If previously oiled, use stain-blocking method. Same options as dark wood.
-Paint: 1st coat, 1hr drying. Additional coats 1hr apart. Final coat dry 2hrs. Silicone brush or foam roller. Spraying: dilute max 30% distilled water.
-Seal: 2-3 coats sealer. 1hr between coats. Pappa G's Waxes for authentic finish. Waxes decorative not protective. Sealers cannot go over waxes.
-
-PORCELAIN AND POLISHED TILES:
-Preparation: High gloss functional surfaces require sanding or priming. Use Block & Tackle or Zinsser 123. Or sand until de-glossed. Paint a layer in single direction, dry overnight. Additional layers in one direction. Final coat cure overnight. Seal with 3 coats Armour 1hr apart. Clean with mild liquid soap and warm water only.
-Paint: 1st coat in one direction, dry overnight. Additional coats 2-3hrs apart, same direction. Final coat dry overnight. Silicone brush or foam roller for smooth, brush for textured.
-Seal: 3 coats Armour, 2hrs apart. Maintenance coat every 12 months. In-shower: use clear non-yellowing solvent-based marine grade varnish.
-
 SURFACE PREP RULES:
+- Surface preparation guides exist for: {SURFACE_TITLES}. The guides for the surfaces this customer has mentioned are given below.
 - When giving prep advice, ALWAYS match it to the surface the user mentioned in their guided question answers. If they said melamine, give melamine prep. If they said wood, ask if it is bare, stained, or varnished to give the right advice.
+- If no guide is given for their surface yet, ask what surface they are painting before giving detailed prep steps.
 - Keep prep advice concise but accurate. Give the key steps, not every detail at once.
-- If the user asks a follow-up about prep, provide more detail from the relevant surface section above.
+- If the user asks a follow-up about prep, provide more detail from the relevant surface guide.
 
 BEHAVIOUR:
 - Keep responses SHORT (2-3 sentences max, mobile-friendly)
@@ -195,69 +97,315 @@ BEHAVIOUR:
 - If unsure, direct to grannyb.co.za or Leroy Merlin staff
 - Use emoji sparingly, max 1 per message"""
 
-        if flow == 'consultation':
-            base_info = consultation_intro + shared_sections
-        else:
-            base_info = product_intro + shared_sections
-
-        context_line = f"- Customer scanned SKU: {sku}" if flow == 'product' and sku else "- Full consultation (no specific product scanned)"
+# The static part of the system prompt depends only on flow and language.
+# It is assembled once per flow x language at import and sent as a cached
+# block, so repeat turns hit the provider prompt cache. The scanned product
+# and the surface guides the conversation has touched follow it, then the
+# small context block.
+FORMATTING_RULES = """FORMATTING RULES: Never use markdown formatting in your responses. No asterisks (**), no hashtags (## or ###), no bullet points (-). Write in plain conversational paragraphs only. Keep responses warm and conversational."""
 
-        system_prompt = f"""{base_info}
-
-CONTEXT:
-{context_line}
-- Store: {store}
+def build_static_prompt(flow, lang_config):
+    intro = CONSULTATION_INTRO if flow == 'consultation' else PRODUCT_INTRO
+    return f"""{intro + SHARED_SECTIONS}
 
 LANGUAGE INSTRUCTION:
 {lang_config['instruction']}
 
 IMPORTANT: Respond ENTIRELY in {lang_config['name']}. All explanations and conversations must be in {lang_config['name']}.
 
-FORMATTING RULES: Never use markdown formatting in your responses. No asterisks (**), no hashtags (## or ###), no bullet points (-). Write in plain conversational paragraphs only. Keep responses warm and conversational."""
+{FORMATTING_RULES}"""
+
+STATIC_PROMPTS = {
+    (flow, language): build_static_prompt(flow, lang_config)
+    for flow in ('product', 'consultation')
+    for language, lang_config in LANGUAGE_CONFIGS.items()
+}
+
+def knowledge_text(flow, sku, texts):
+    """Scanned product plus the surface guides mentioned in texts."""
+    sections = []
+    if flow == 'product' and sku:
+        sections.append("SCANNED PRODUCT:\n" + product_text(sku))
+    surfaces = relevant_surfaces(texts)
+    if surfaces:
+        sections.append("SURFACE PREPARATION GUIDE:\n\n" + "\n\n".join(surface_text(s) for s in surfaces))
+    return "\n\n".join(sections)
+
+def system_blocks(flow, language, sku, store, summary=None, texts=()):
+    flow = 'consultation' if flow == 'consultation' else 'product'
+    language = language if language in LANGUAGE_CONFIGS else 'en'
+    context_line = f"- Customer scanned SKU: {sku}" if flow == 'product' and sku else "- Full consultation (no specific product scanned)"
+    context = f"CONTEXT:\n{context_line}\n- Store: {store}"
+    if summary and any(summary.values()):
+        context += "\n\n" + summary_text(summary)
+    blocks = [{'type': 'text', 'text': STATIC_PROMPTS[(flow, language)], 'cache_control': {'type': 'ephemeral'}}]
+    knowledge = knowledge_text(flow, sku, texts)
+    if knowledge:
+        blocks.append({'type': 'text', 'text': knowledge})
+    blocks.append({'type': 'text', 'text': context})
+    return blocks
+
+# Conversation window: the newest turns are sent verbatim up to a token
+# budget, and older turns are folded into a small extractive summary that
+# rides in the context block. Guided answers are always kept in full. The
+# client sends back the summary it was given together with only the
+# unfolded messages, so request size stays bounded over a consultation.
+HISTORY_TOKEN_BUDGET = 1500
+MIN_RECENT_MESSAGES = 4
+SUMMARY_ITEMS = 6
+SUMMARY_SNIPPET = 160
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting English/Afrikaans
+    return len(text) // 4 + 1
+
+def snippet(text):
+    first = re.split(r'(?<=[.!?])\s', text.strip(), maxsplit=1)[0]
+    return first if len(first) <= SUMMARY_SNIPPET else first[:SUMMARY_SNIPPET - 3].rstrip() + '...'
+
+def clean_summary(value):
+    summary = {'guided': [], 'asked': [], 'covered': []}
+    if isinstance(value, dict):
+        for key in summary:
+            items = value.get(key)
+            if isinstance(items, list):
+                summary[key] = [str(item)[:SUMMARY_SNIPPET] for item in items if item]
+    return summary
+
+def fold_messages(summary, messages):
+    for msg in messages:
+        if msg['role'] == 'user' and msg.get('guided'):
+            summary['guided'].append(msg['content'])
+        elif msg['role'] == 'user':
+            summary['asked'].append(snippet(msg['content']))
+        else:
+            summary['covered'].append(snippet(msg['content']))
+    summary['asked'] = summary['asked'][-SUMMARY_ITEMS:]
+    summary['covered'] = summary['covered'][-SUMMARY_ITEMS:]
+    return summary
+
+def window_history(history, summary):
+    """(messages to send verbatim, updated summary, number of messages folded)."""
+    used = 0
+    keep = len(history)
+    while keep > 0:
+        cost = estimate_tokens(history[keep - 1]['content'])
+        if len(history) - keep >= MIN_RECENT_MESSAGES and used + cost > HISTORY_TOKEN_BUDGET:
+            break
+        used += cost
+        keep -= 1
+    # The verbatim window has to open on a user turn
+    while keep < len(history) and history[keep]['role'] != 'user':
+        keep += 1
+    if keep:
+        summary = fold_messages(summary, history[:keep])
+    return history[keep:], summary, keep
+
+def summary_text(summary):
+    lines = ["EARLIER IN THIS CONVERSATION (older turns, summarised):"]
+    if summary['guided']:
+        lines.append("- Guided answers so far: " + "; ".join(summary['guided']))
+    if summary['asked']:
+        lines.append("- The customer asked: " + " | ".join(summary['asked']))
+    if summary['covered']:
+        lines.append("- You already told them: " + " | ".join(summary['covered']))
+    return "\n".join(lines)
+
+API_ERROR_REPLY = "Oops, I'm having a brief hiccup. Please try again, or ask a Leroy Merlin team member nearby for help!"
+FAILURE_REPLY = "I'm experiencing technical difficulties. Please ask a Leroy Merlin team member for help or visit grannyb.co.za"
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode()
+
+def iter_text_deltas(response):
+    """Text deltas from a Messages API event stream."""
+    for raw in response:
+        line = raw.decode('utf-8').strip()
+        if not line.startswith('data:'):
+            continue
+        event = json.loads(line[5:])
+        if event.get('type') == 'content_block_delta' and event['delta'].get('type') == 'text_delta':
+            yield event['delta']['text']
+        elif event.get('type') == 'error':
+            raise RuntimeError(event.get('error', {}).get('message', 'stream error'))
+
+class handler(BaseHTTPRequestHandler):
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+        return
+
+    def do_POST(self):
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        data = json.loads(post_data)
+
+        api_key = os.environ.get('ANTHROPIC_API_KEY')
+
+        if not api_key:
+            self.send_error(500, "API key not configured")
+            return
+
+        url = "https://api.anthropic.com/v1/messages"
 
-        messages = []
+        language = data.get('language', 'en')
+        sku = data.get('sku', '81415711')
+        store = data.get('store', 'leroy-merlin')
+        flow = data.get('flow', 'product')
+
+        # The history lives server-side under a chat token issued with the
+        # first reply; the client sends it back with only the new message
+        # plus its message count ('turns'). If the counts disagree (expired
+        # session, failed save) it gets a 409 and resends its history, which
+        # is also how older clients always work.
+        token = data.get('chatToken')
+        if not valid_token(token):
+            token = None
+        history = []
+        start = 0
+        client_history = False
 
         if 'history' in data and isinstance(data['history'], list):
+            client_history = True
             for msg in data['history']:
                 if 'role' in msg and 'content' in msg:
                     if msg['role'] in ['user', 'assistant']:
-                        messages.append({
+                        history.append({
                             'role': msg['role'],
-                            'content': msg['content']
+                            'content': str(msg['content']),
+                            'guided': bool(msg.get('guided'))
                         })
-
+            if isinstance(data.get('historyStart'), int):
+                start = min(max(data['historyStart'], 0), len(history))
+            summary = clean_summary(data.get('summary'))
+        elif token or data.get('turns'):
+            session = load_session(token) if data.get('turns') else new_session()
+            if not in_sync(session, data.get('turns', 0)):
+                self._send_json(409, {'error': 'Session out of sync', 'resync': True})
+                return
+            history, start, summary = session['history'], session['start'], clean_summary(session['summary'])
+            client_history = bool(session.get('client'))
+        else:
+            summary = clean_summary(None)
+
+        messages, summary, folded = window_history(history[start:], summary)
+        messages = [{'role': msg['role'], 'content': msg['content']} for msg in messages]
+        token = token or new_token()
+        # Returned so the client can drop folded messages and send the summary
+        window = {'summary': summary, 'folded': folded, 'chatToken': token}
+        turn = {'role': 'user', 'content': str(data.get('message', '')), 'guided': bool(data.get('guided'))}
+        # Surface guides are sent for any surface the shopper has mentioned
+        surface_hints = [msg['content'] for msg in history if msg['role'] == 'user']
+        surface_hints += summary['guided'] + summary['asked'] + [turn['content']]
+
+        # Breakpoint on the newest turn: the next request's history starts
+        # with this exact prefix, so it is read back from the prompt cache
         messages.append({
             'role': 'user',
-            'content': data.get('message', '')
+            'content': [{
+                'type': 'text',
+                'text': data.get('message', ''),
+                'cache_control': {'type': 'ephemeral'}
+            }]
         })
 
+        # The model is picked per attempt by _routing
         api_data = {
-            "model": "claude-sonnet-4-20250514",
             "max_tokens": 1024,
-            "system": system_prompt,
+            "system": system_blocks(flow, language, sku, store, summary, surface_hints),
             "messages": messages
         }
+        # {"stream": true} relays the reply as Server-Sent Events; anything
+        # else gets the original single JSON response
+        stream = bool(data.get('stream'))
 
-        req = urllib.request.Request(url, json.dumps(api_data).encode(), {
+        headers = {
             'Content-Type': 'application/json',
             'x-api-key': api_key,
             'anthropic-version': '2023-06-01'
-        })
+        }
+
+        # Pure guided-option conversations are shared between shoppers. A
+        # client-supplied history or summary can carry any assistant text
+        # into the prompt, so those turns neither read nor fill the cache.
+        reply_key = None if client_history else cache_key(flow, language, sku, store, history, turn['content'])
+        local_reply = get_reply(reply_key) if reply_key else None
+        # Common free-text questions are answered from the local FAQ
+        if not local_reply and not turn['guided']:
+            local_reply = faq_answer(turn['content'], language)
 
+        streamed = False
         try:
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode())
-                bot_response = result['content'][0]['text']
+            if local_reply:
+                bot_response = local_reply
+            else:
+                bot_response, cacheable = self._call_api(url, headers, api_data, window, stream)
+                streamed = stream
+                if reply_key and cacheable and bot_response:
+                    put_reply(reply_key, bot_response)
         except urllib.error.HTTPError as e:
             error_body = e.read().decode() if e.fp else ''
             print(f"API Error: {e.code} - {error_body}")
-            bot_response = "Oops, I'm having a brief hiccup. Please try again, or ask a Leroy Merlin team member nearby for help!"
+            bot_response = API_ERROR_REPLY
         except Exception as e:
             print(f"Error: {str(e)}")
-            bot_response = "I'm experiencing technical difficulties. Please ask a Leroy Merlin team member for help or visit grannyb.co.za"
+            bot_response = FAILURE_REPLY
+
+        # The client keeps fallback replies too, so the session does as well
+        save_session(token, {
+            'history': history + [turn, {'role': 'assistant', 'content': bot_response, 'guided': False}],
+            'start': start + folded,
+            'summary': summary,
+            # Once seeded from a client history the session stays untrusted
+            'client': client_history
+        })
+        if not streamed:
+            self._send_json(200, dict(window, response=bot_response))
+
+    def _call_api(self, url, headers, api_data, window, stream):
+        """(reply text, whether it may be cached).
+
+        Only complete replies from the primary model are cached; a fallback
+        answer is fine for this shopper but should not outlive the outage.
+        """
+        response, model = open_reply(url, headers, api_data)
+        with response:
+            if stream:
+                reply, complete = self._relay_stream(response, window)
+            else:
+                reply, complete = ''.join(iter_text_deltas(response)), True
+        return reply, complete and model == PRIMARY_MODEL
+
+    def _send_json(self, status, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
 
+    def _relay_stream(self, response, window):
+        # Upstream errors before this point still get the JSON reply above
         self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(json.dumps({'response': bot_response}).encode())
+        parts = []
+        try:
+            for text in iter_text_deltas(response):
+                parts.append(text)
+                self.wfile.write(sse_event('delta', {'text': text}))
+                self.wfile.flush()
+            reply, complete = ''.join(parts), True
+        except Exception as e:
+            print(f"Stream error: {str(e)}")
+            reply, complete = ''.join(parts) or FAILURE_REPLY, False
+        try:
+            self.wfile.write(sse_event('done', dict(window, response=reply)))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the shopper navigated away mid-reply
+        return reply, complete
@@ -1,9 +1,11 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import urllib.request
+import urllib.error
 import os
 from datetime import datetime
 
+import _http
+
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
         self.send_response(200)
@@ -124,17 +126,13 @@ class handler(BaseHTTPRequestHandler):
             "htmlContent": email_html
         }
 
-        req = urllib.request.Request(
-            brevo_url,
-            json.dumps(brevo_data).encode(),
-            {
-                'Content-Type': 'application/json',
-                'api-key': brevo_key
-            }
-        )
+        headers = {
+            'Content-Type': 'application/json',
+            'api-key': brevo_key
+        }
 
         try:
-            with urllib.request.urlopen(req) as response:
+            with _http.post(brevo_url, json.dumps(brevo_data).encode(), headers) as response:
                 result = json.loads(response.read().decode())
                 success = True
                 message = "You're all set! Enjoy your paint advice."
@@ -1,9 +1,12 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import urllib.request
+import urllib.error
 import os
 import re
 
+import _http
+from _sessions import in_sync, load_session
+
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
         self.send_response(200)
@@ -27,6 +30,15 @@ class handler(BaseHTTPRequestHandler):
 
         # Accept both field names for backwards compatibility
         history = data.get('chatHistory', data.get('history', []))
+        if not history and data.get('chatToken'):
+            # /chat keeps the conversation server-side under the token it
+            # issued; the client only resends it when its message count
+            # disagrees with the session
+            session = load_session(data['chatToken'])
+            if not in_sync(session, data.get('turns')):
+                self._respond({'success': False, 'error': 'Session out of sync', 'resync': True}, 409)
+                return
+            history = session['history']
         language = data.get('language', 'en')
         name = data.get('name', '')
         email = data.get('email', '')
@@ -56,8 +68,8 @@ class handler(BaseHTTPRequestHandler):
 
         self._respond({'success': True, 'recap': recap, 'emailSent': email_sent})
 
-    def _respond(self, data):
-        self.send_response(200)
+    def _respond(self, data, status=200):
+        self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
@@ -99,14 +111,14 @@ Extract what was actually discussed. Do not invent information not present in th
             ]
         }
 
-        req = urllib.request.Request(url, json.dumps(api_data).encode(), {
+        headers = {
             'Content-Type': 'application/json',
             'x-api-key': api_key,
             'anthropic-version': '2023-06-01'
-        })
+        }
 
         try:
-            with urllib.request.urlopen(req) as response:
+            with _http.post(url, json.dumps(api_data).encode(), headers) as response:
                 result = json.loads(response.read().decode())
                 raw_text = result['content'][0]['text']
                 print(f"Claude recap raw: {raw_text[:300]}")
@@ -280,18 +292,14 @@ Extract what was actually discussed. Do not invent information not present in th
         payload = json.dumps(brevo_data, ensure_ascii=False).encode('utf-8')
         print(f"Brevo payload keys: {list(brevo_data.keys())}, payload size: {len(payload)}")
 
-        req = urllib.request.Request(
-            brevo_url,
-            payload,
-            {
-                'Content-Type': 'application/json; charset=utf-8',
-                'Accept': 'application/json',
-                'api-key': brevo_key
-            }
-        )
+        headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Accept': 'application/json',
+            'api-key': brevo_key
+        }
 
         try:
-            with urllib.request.urlopen(req) as response:
+            with _http.post(brevo_url, payload, headers) as response:
                 json.loads(response.read().decode())
                 return True
         except urllib.error.HTTPError as e:
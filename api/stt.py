@@ -1,10 +1,11 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import urllib.request
 import os
 import cgi
 import io
 
+import _http
+
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
         self.send_response(200)
@@ -89,16 +90,12 @@ class handler(BaseHTTPRequestHandler):
             
             body_data = b'\r\n'.join(body)
             
-            req = urllib.request.Request(
-                'https://api.openai.com/v1/audio/transcriptions',
-                body_data,
-                {
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': f'multipart/form-data; boundary={boundary}'
-                }
-            )
-            
-            with urllib.request.urlopen(req) as response:
+            headers = {
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': f'multipart/form-data; boundary={boundary}'
+            }
+
+            with _http.post('https://api.openai.com/v1/audio/transcriptions', body_data, headers) as response:
                 result = json.loads(response.read().decode())
                 transcribed_text = result.get('text', '')
                 
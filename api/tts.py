@@ -1,9 +1,10 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import urllib.request
 import os
 import base64
 
+import _http
+
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
         self.send_response(200)
@@ -77,13 +78,7 @@ class handler(BaseHTTPRequestHandler):
         }
         
         try:
-            req = urllib.request.Request(
-                url,
-                json.dumps(payload).encode(),
-                {'Content-Type': 'application/json'}
-            )
-            
-            with urllib.request.urlopen(req) as response:
+            with _http.post(url, json.dumps(payload).encode(), {'Content-Type': 'application/json'}) as response:
                 result = json.loads(response.read().decode())
                 return result.get('audioContent', None)
                 
@@ -112,17 +107,13 @@ class handler(BaseHTTPRequestHandler):
         }
         
         try:
-            req = urllib.request.Request(
-                url,
-                json.dumps(payload).encode(),
-                {
-                    'Content-Type': 'application/json',
-                    'xi-api-key': api_key,
-                    'Accept': 'audio/mpeg'
-                }
-            )
-            
-            with urllib.request.urlopen(req) as response:
+            headers = {
+                'Content-Type': 'application/json',
+                'xi-api-key': api_key,
+                'Accept': 'audio/mpeg'
+            }
+
+            with _http.post(url, json.dumps(payload).encode(), headers) as response:
                 audio_data = response.read()
                 return base64.b64encode(audio_data).decode('utf-8')
                 
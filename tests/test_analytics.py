@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import analytics
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+@unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+class StreamWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (analytics._redis_client, analytics.REDIS_MODE)
+        analytics._redis_client = fakeredis.FakeRedis(decode_responses=True)
+        analytics.REDIS_MODE = 'streams'
+        now = time.time()
+        # Two events yesterday, one today, with the entry IDs XADD would
+        # have given them when they arrived
+        for sid, ts in (('s0', now - 86400 - 2), ('s1', now - 86400 - 1), ('s2', now - 1)):
+            event = {'sessionId': sid, 'store': 'x', 'event_type': 'scan', 'event_data': {},
+                     'timestamp': '', 'server_time': round(ts, 3)}
+            analytics._redis_client.xadd(analytics.STREAM_KEY, {'s': 'x', 'e': analytics.encode_event(event)},
+                                         id='%d-0' % round(ts * 1000))
+            for command in analytics.rollup_commands(event):
+                analytics._redis_client.execute_command(*command)
+        self.first_id = analytics._redis_client.xrange(analytics.STREAM_KEY, count=1)[0][0]
+
+    def tearDown(self):
+        analytics._redis_client, analytics.REDIS_MODE = self.saved
+
+    def sessions(self, items):
+        return [event['sessionId'] for event in analytics.decode_events(items)]
+
+    def test_since_keeps_a_later_start(self):
+        start = analytics.parse_time('2099-01-01')
+        self.assertEqual(self.sessions(analytics.iter_events(start=start, since=self.first_id)), [])
+
+    def test_recent_events_across_days_with_an_old_cursor(self):
+        start = time.time() - 3 * 86400
+        cursor = {}
+        items = analytics.recent_events(10, start=start, since=self.first_id, cursor=cursor)
+        self.assertEqual(self.sessions(items), ['s1', 's2'])
+        last_id = analytics._redis_client.xrevrange(analytics.STREAM_KEY, count=1)[0][0]
+        self.assertEqual(cursor['value'], last_id)
+        self.assertEqual(self.sessions(analytics.recent_events(10, start=start, since='0-0')), ['s0', 's1', 's2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import _faq
+from _knowledge import FACTS
+
+def matched(question):
+    found = _faq.match(question)
+    return found and found[0]['id']
+
+class MatchTest(unittest.TestCase):
+
+    def test_common_questions(self):
+        self.assertEqual(matched("How long does it take to dry?"), 'drying')
+        self.assertEqual(matched("Hoe lank neem dit om droog te word?"), 'drying')
+        self.assertEqual(matched("how much does a litre cover"), 'coverage')
+        self.assertEqual(matched("Kan ek aanlyn koop?"), 'online')
+
+    def test_words_from_another_fact_go_to_the_model(self):
+        self.assertIsNone(matched("How long does delivery take?"))
+        self.assertIsNone(matched("How much does delivery cost?"))
+        self.assertIsNone(matched("How long does the wax take to dry?"))
+        self.assertIsNone(matched("how long does armour take to dry"))
+        self.assertIsNone(matched("how long does it take to cure on tiles"))
+        self.assertIsNone(matched("Can I paint over wax?"))
+        self.assertIsNone(matched("can I put wax over sealer"))
+
+class AnswerTest(unittest.TestCase):
+
+    def test_figures_come_from_knowledge(self):
+        text = _faq.answer("what sizes do you have", 'en')
+        self.assertIn(FACTS['sample_price'], text)
+        self.assertIn(FACTS['litre_price'], text)
+        self.assertIn(FACTS['full_cure_days'], _faq.answer("How long does it take to dry?", 'af'))
+
+    def test_every_answer_renders(self):
+        for entry in _faq.FAQ_ENTRIES:
+            for text in entry['answer'].values():
+                self.assertNotIn('{', text.format_map(FACTS))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+import urllib.error
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import _routing
+
+# model -> how the fake upstream answers it: 'fast', 'slow' or an HTTP status
+BEHAVIOUR = {}
+# models in the order requests reached the fake upstream
+REQUESTS = []
+SLOW_SECONDS = 1.0
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        model = payload['model']
+        REQUESTS.append(model)
+        behaviour = BEHAVIOUR.get(model, 'fast')
+        if isinstance(behaviour, int):
+            body = json.dumps({'type': 'error', 'error': {'type': 'overloaded_error'}}).encode()
+            self.send_response(behaviour)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if behaviour == 'slow':
+            time.sleep(SLOW_SECONDS)
+        body = f'event: message_stop\ndata: {{"model": "{model}"}}\n\n'.encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # the hedge won and the client hung up
+
+class OpenReplyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUpstream)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://127.0.0.1:%d/v1/messages' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.saved = (_routing.PRIMARY_MODEL, _routing.FALLBACK_MODEL, _routing.HEDGE_AFTER)
+        _routing.PRIMARY_MODEL, _routing.FALLBACK_MODEL, _routing.HEDGE_AFTER = 'primary', 'fallback', 0.2
+        _routing._breakers.clear()
+        BEHAVIOUR.clear()
+        REQUESTS.clear()
+
+    def tearDown(self):
+        _routing.PRIMARY_MODEL, _routing.FALLBACK_MODEL, _routing.HEDGE_AFTER = self.saved
+        _routing._breakers.clear()
+
+    def open_reply(self):
+        response, model = _routing.open_reply(self.url, {'Content-Type': 'application/json'}, {'messages': []})
+        with response:
+            body = response.read().decode()
+        self.assertIn(f'"model": "{model}"', body)
+        return model
+
+    def test_fast_primary(self):
+        self.assertEqual(self.open_reply(), 'primary')
+        self.assertTrue(_routing.available('primary'))
+
+    def test_slow_primary_hedges_then_trips_breaker(self):
+        BEHAVIOUR['primary'] = 'slow'
+        for _ in range(_routing.BREAKER_FAILURES):
+            started = time.monotonic()
+            self.assertEqual(self.open_reply(), 'fallback')
+            self.assertLess(time.monotonic() - started, SLOW_SECONDS)
+        self.assertFalse(_routing.available('primary'))
+        self.assertEqual(_routing.route(), ('fallback', 'fallback'))
+        self.assertEqual(self.open_reply(), 'fallback')
+
+    def test_overloaded_primary_fails_over(self):
+        BEHAVIOUR['primary'] = 529
+        started = time.monotonic()
+        self.assertEqual(self.open_reply(), 'fallback')
+        # A fast error fails over at once rather than waiting out the hedge delay
+        self.assertLess(time.monotonic() - started, _routing.HEDGE_AFTER)
+
+    def test_every_model_failing_raises(self):
+        BEHAVIOUR['primary'] = BEHAVIOUR['fallback'] = 529
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            _routing.open_reply(self.url, {}, {'messages': []})
+        self.assertEqual(raised.exception.code, 529)
+
+    def test_bad_request_is_raised_without_failover(self):
+        BEHAVIOUR['primary'] = 400
+        for _ in range(_routing.BREAKER_FAILURES):
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                _routing.open_reply(self.url, {}, {'messages': []})
+            self.assertEqual(raised.exception.code, 400)
+        self.assertEqual(REQUESTS, ['primary'] * _routing.BREAKER_FAILURES)
+        self.assertTrue(_routing.available('primary'))
+
+if __name__ == '__main__':
+    unittest.main()